@@ -0,0 +1,101 @@
+import csv
+import json
+import random
+from pathlib import Path
+
+WORDS = (
+    "once upon a time there was a little girl named lily she loved to play "
+    "in the forest with her dog max one day they found a shiny key under an "
+    "old tree the key opened a door to a secret garden full of flowers"
+).split()
+PROMPTS = (
+    "Create a level-{level} fantasy quest set in a {setting} with a {tone} tone."
+)
+SETTINGS = ("forest", "castle", "desert", "village", "cave")
+TONES = ("heroic", "mysterious", "dark", "epic", "humorous")
+
+
+def story(rng, min_words=40, max_words=180):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def prompt(rng):
+    return PROMPTS.format(
+        level=rng.randint(1, 5), setting=rng.choice(SETTINGS), tone=rng.choice(TONES)
+    )
+
+
+def write_jokes_csv(path: Path, rows: int, seed: int = 0) -> Path:
+    """Reddit-jokes shaped CSV, with some rows the download filters should drop."""
+    rng = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(["title", "body", "score", "id", "author"])
+        for index in range(rows):
+            body = "[deleted]" if index % 50 == 0 else story(rng, 5, 60) + "\n" + story(rng, 1, 10)
+            writer.writerow(
+                [prompt(rng), body, rng.randint(0, 500), f"id{index}", rng.choice(["", "bob", "ana"])]
+            )
+    return path
+
+
+def write_split_dir(root: Path, rows: int, seed: int = 0) -> Path:
+    """train/val/test.jsonl in the download_data.py schema (80/10/10)."""
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    sizes = {"train": rows * 8 // 10, "val": rows // 10, "test": rows - rows * 8 // 10 - rows // 10}
+    for split, count in sizes.items():
+        with (root / f"{split}.jsonl").open("w", encoding="utf-8") as handle:
+            for index in range(max(count, 1)):
+                record = {
+                    "prompt": prompt(rng),
+                    "response": story(rng),
+                    "source": "tinystories",
+                    "metadata": {"id": f"{split}-{index}", "level": rng.randint(1, 5)},
+                }
+                handle.write(json.dumps(record) + "\n")
+    return root
+
+
+def write_generations(path: Path, rows: int, seed: int = 0, field: str = "response") -> Path:
+    rng = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as handle:
+        for _ in range(rows):
+            handle.write(json.dumps({"prompt": prompt(rng), field: story(rng, 10, 120)}) + "\n")
+    return path
+
+
+def write_tiny_model(path: Path, seed: int = 0) -> Path:
+    """Randomly initialised 2-layer GPT-2 with a small byte-level BPE vocab (no downloads)."""
+    if (path / "config.json").exists():
+        return path
+    import torch
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import GPT2Config, GPT2LMHeadModel, GPT2TokenizerFast
+
+    rng = random.Random(seed)
+    path.mkdir(parents=True, exist_ok=True)
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(
+        [prompt(rng) + " " + story(rng) for _ in range(500)],
+        vocab_size=512,
+        special_tokens=["<|endoftext|>"],
+    )
+    bpe.save_model(str(path))
+    tokenizer = GPT2TokenizerFast(str(path / "vocab.json"), str(path / "merges.txt"))
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = GPT2Config(
+        vocab_size=len(tokenizer),
+        n_positions=512,
+        n_embd=64,
+        n_layer=2,
+        n_head=2,
+        bos_token_id=tokenizer.eos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    GPT2LMHeadModel(config).save_pretrained(path)
+    return path
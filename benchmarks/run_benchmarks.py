@@ -0,0 +1,303 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import sys
+import tempfile
+import time
+from argparse import Namespace
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "scripts"))
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fixtures  # noqa: E402
+
+GENERATION_MAX_ROWS = 256
+# How often the parent checks that a benchmark child is still alive.
+POLL_SECONDS = 1.0
+
+
+def peak_rss_mb():
+    # Stages that fan out to worker processes are charged their largest worker too.
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is bytes on macOS and kilobytes on Linux.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def bench_download_data(workdir: Path, rows: int):
+    import download_data
+
+    csv_path = fixtures.write_jokes_csv(workdir / "jokes.csv", rows)
+    argv = sys.argv
+    sys.argv = [
+        "download_data.py",
+        "--dataset",
+        "redditjokes",
+        "--local_csv",
+        str(csv_path),
+        "--output_dir",
+        str(workdir / "raw"),
+    ]
+    try:
+        start = time.perf_counter()
+        download_data.main()
+        return time.perf_counter() - start, rows
+    finally:
+        sys.argv = argv
+
+
+def bench_prepare_training_data(workdir: Path, rows: int):
+    import prepare_training_data
+
+    root = fixtures.write_split_dir(workdir / "raw", rows)
+    args = Namespace(
+        prompt_prefix="User: ",
+        response_prefix="Assistant: ",
+        separator="\n\n",
+        control_keys=["level"],
+        control_format="[{key}:{value}] ",
+        drop_missing_control=False,
+        num_proc=None,
+    )
+    start = time.perf_counter()
+    written, dropped = prepare_training_data.process_split(
+        root / "train.jsonl", workdir / "processed" / "train.jsonl", args
+    )
+    return time.perf_counter() - start, written + dropped
+
+
+def bench_compute_dataset_stats(workdir: Path, rows: int):
+    import compute_dataset_stats
+
+    root = fixtures.write_split_dir(workdir / "raw", rows)
+    splits = {split: root / f"{split}.jsonl" for split in compute_dataset_stats.SPLIT_NAMES}
+    start = time.perf_counter()
+    compute_dataset_stats.compute_all_stats(splits, "response")
+    return time.perf_counter() - start, rows
+
+
+def bench_evaluate_outputs(workdir: Path, rows: int):
+    import evaluate_outputs
+    from jsonl_utils import load_jsonl
+
+    path = fixtures.write_generations(workdir / "baseline.jsonl", rows)
+    start = time.perf_counter()
+    evaluate_outputs.compute_metrics(load_jsonl(path), min_chars=20)
+    return time.perf_counter() - start, rows
+
+
+def bench_compare_outputs(workdir: Path, rows: int):
+    import compare_outputs
+
+    baseline = fixtures.write_generations(workdir / "baseline.jsonl", rows, seed=1)
+    tuned = fixtures.write_generations(workdir / "tuned.jsonl", rows, seed=1)
+    argv = sys.argv
+    sys.argv = [
+        "compare_outputs.py",
+        "--baseline",
+        str(baseline),
+        "--tuned",
+        str(tuned),
+        "--output",
+        str(workdir / "compare.csv"),
+    ]
+    try:
+        start = time.perf_counter()
+        compare_outputs.main()
+        return time.perf_counter() - start, rows
+    finally:
+        sys.argv = argv
+
+
+def bench_generation(workdir: Path, rows: int):
+    import random
+
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from generation_engine import generate_batched
+
+    model_dir = fixtures.write_tiny_model(workdir / "tiny-gpt2")
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForCausalLM.from_pretrained(model_dir).eval()
+    torch.manual_seed(0)
+    rng = random.Random(0)
+    prompts = [fixtures.prompt(rng) for _ in range(min(rows, GENERATION_MAX_ROWS))]
+    start = time.perf_counter()
+    generate_batched(model, tokenizer, prompts, batch_size=16, max_new_tokens=16, do_sample=False)
+    return time.perf_counter() - start, len(prompts)
+
+
+BENCHMARKS = {
+    "download_data": bench_download_data,
+    "prepare_training_data": bench_prepare_training_data,
+    "compute_dataset_stats": bench_compute_dataset_stats,
+    "evaluate_outputs": bench_evaluate_outputs,
+    "compare_outputs": bench_compare_outputs,
+    "generation": bench_generation,
+}
+
+
+def _run_in_child(name, rows, results):
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as tmp:
+        # Keep datasets' Arrow cache per run so every measurement starts cold.
+        os.environ["HF_DATASETS_CACHE"] = str(Path(tmp) / "hf_cache")
+        try:
+            seconds, processed = BENCHMARKS[name](Path(tmp), rows)
+            results.put({"seconds": seconds, "processed": processed, "peak_rss_mb": peak_rss_mb()})
+        except Exception as exc:  # reported as a failed result, not a crash of the suite
+            results.put({"error": f"{type(exc).__name__}: {exc}"})
+
+
+def wait_for_outcome(process, results, timeout):
+    """The child's result, or an error if it dies silently (segfault, OOM kill) or times out."""
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        try:
+            return results.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            if process.exitcode is not None:
+                return {"error": f"benchmark process exited with code {process.exitcode}"}
+            if deadline is not None and time.monotonic() > deadline:
+                process.terminate()
+                return {"error": f"timed out after {timeout:g}s"}
+
+
+def run_benchmark(name, rows, timeout=None):
+    """Run one benchmark in a fresh process so peak RSS is its own."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_in_child, args=(name, rows, results))
+    process.start()
+    outcome = wait_for_outcome(process, results, timeout)
+    process.join()
+
+    result = {"name": name, "rows": rows}
+    if "error" in outcome:
+        result["error"] = outcome["error"]
+        return result
+    seconds = outcome["seconds"]
+    result.update(
+        {
+            "processed": outcome["processed"],
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(outcome["processed"] / seconds, 2) if seconds else 0.0,
+            "peak_rss_mb": round(outcome["peak_rss_mb"], 1),
+        }
+    )
+    return result
+
+
+def find_regressions(results, baseline, max_regression):
+    previous = {(r["name"], r["rows"]): r for r in baseline.get("results", []) if "error" not in r}
+    regressions = []
+    for result in results:
+        before = previous.get((result["name"], result["rows"]))
+        if before is None or "error" in result:
+            continue
+        if result["rows_per_sec"] < before["rows_per_sec"] * (1 - max_regression):
+            regressions.append(
+                f"{result['name']}@{result['rows']}: throughput "
+                f"{before['rows_per_sec']} -> {result['rows_per_sec']} rows/sec"
+            )
+        if result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + max_regression):
+            regressions.append(
+                f"{result['name']}@{result['rows']}: peak RSS "
+                f"{before['peak_rss_mb']} -> {result['peak_rss_mb']} MB"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every QuestCrafter pipeline stage.")
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000",
+        help="Comma-separated fixture sizes in rows (e.g. 1000,10000,100000,1000000).",
+    )
+    parser.add_argument(
+        "--only",
+        default="",
+        help=f"Comma-separated subset of: {', '.join(BENCHMARKS)}.",
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmarks/results/latest.json",
+        help="Where to write the JSON results.",
+    )
+    parser.add_argument(
+        "--baseline", default=None, help="Saved results JSON to compare against."
+    )
+    parser.add_argument(
+        "--max_regression",
+        type=float,
+        default=0.2,
+        help="Allowed fractional throughput drop / peak RSS growth vs the baseline.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=3600,
+        help="Seconds before a single benchmark run is killed and counted as failed (0: no limit).",
+    )
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.only.split(",") if n.strip()] or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks: {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    results = []
+    for name in names:
+        for rows in sizes:
+            result = run_benchmark(name, rows, args.timeout)
+            results.append(result)
+            if "error" in result:
+                print(f"{name:<24} {rows:>8} rows  FAILED {result['error']}")
+            else:
+                print(
+                    f"{name:<24} {rows:>8} rows  {result['seconds']:>9.3f}s  "
+                    f"{result['rows_per_sec']:>12.1f} rows/s  {result['peak_rss_mb']:>8.1f} MB"
+                )
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Wrote results to {output_path}")
+
+    failed = [f"{r['name']}@{r['rows']}: {r['error']}" for r in results if "error" in r]
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = find_regressions(results, baseline, args.max_regression)
+        if regressions:
+            print("Regressions vs baseline:")
+            for line in regressions:
+                print(f"- {line}")
+        else:
+            print("No regressions vs baseline.")
+    if failed:
+        print("Failed benchmarks:")
+        for line in failed:
+            print(f"- {line}")
+    if failed or regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
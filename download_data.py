@@ -1,9 +1,29 @@
 import argparse
+import hashlib
+import json
+import random
 import re
+import sys
+import tempfile
 from pathlib import Path
 
 import datasets
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / "scripts"))
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import SPLIT_FORMATS, convert_split, write_columnar
+from minhash_dedup import dedup_splits
+from pipeline_manifest import (
+    APPENDED,
+    CHANGED,
+    HASH_CHUNK_BYTES,
+    UNCHANGED,
+    StageManifest,
+    add_manifest_args,
+    stage_args,
+    write_tail,
+)
+
 
 DATASET_CONFIGS = {
     "writingprompts": {
@@ -23,6 +43,9 @@ DATASET_CONFIGS = {
     },
 }
 
+METADATA_KEYS = ("score", "author", "id", "subreddit")
+SPLIT_FILES = {"train": "train.jsonl", "validation": "val.jsonl", "test": "test.jsonl"}
+
 
 def ensure_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
@@ -38,6 +61,14 @@ def get_columns(dataset):
     return dataset.column_names
 
 
+def peek_columns(dataset):
+    columns = get_columns(dataset)
+    if columns is not None:
+        return columns
+    first = dataset[next(iter(dataset.keys()))] if isinstance(dataset, dict) else dataset
+    return list(next(iter(first)).keys())
+
+
 def resolve_field(columns, field_name, fallbacks):
     if field_name and field_name in columns:
         return field_name
@@ -75,6 +106,96 @@ def make_splits(dataset, seed: int):
     return split["train"], val_test["train"], val_test["test"]
 
 
+def hash_split(key, seed):
+    """Stable 80/10/10 assignment: depends only on the row key and the seed."""
+    digest = hashlib.blake2b(f"{seed}\x00{key}".encode("utf-8"), digest_size=8).digest()
+    draw = int.from_bytes(digest, "big") / 2**64
+    return "train" if draw < 0.8 else "validation" if draw < 0.9 else "test"
+
+
+def split_key(prompt, response, key_value=None):
+    # An explicit id wins; otherwise the cleaned, lowercased content identifies the row.
+    if key_value not in (None, ""):
+        return str(key_value)
+    return f"{prompt.lower()}\n{response.lower()}"
+
+
+def _assign_splits(batch, seed, key_field):
+    keys = batch[key_field] if key_field else [None] * len(batch["_response"])
+    return {
+        "_split": [
+            hash_split(split_key(prompt, response, key), seed)
+            for prompt, response, key in zip(batch["_prompt"], batch["_response"], keys)
+        ]
+    }
+
+
+def make_hash_splits(dataset, seed: int, key_field=None, num_proc=None):
+    """Assign every row by hash_split, without shuffling or index permutations.
+
+    Sources that already ship train/validation/test keep them, as in make_splits;
+    otherwise rows from all source splits are pooled and assigned independently,
+    so existing rows keep their split when the corpus grows.
+    """
+    if all(name in dataset for name in SPLIT_FILES):
+        return dataset["train"], dataset["validation"], dataset["test"]
+
+    parts = list(dataset.values())
+    pooled = parts[0] if len(parts) == 1 else datasets.concatenate_datasets(parts)
+    tagged = pooled.map(
+        _assign_splits,
+        batched=True,
+        fn_kwargs={"seed": seed, "key_field": key_field},
+        num_proc=num_proc,
+    )
+    return tuple(
+        tagged.filter(
+            lambda splits, name=name: [split == name for split in splits],
+            input_columns="_split",
+            batched=True,
+            num_proc=num_proc,
+        ).remove_columns("_split")
+        for name in SPLIT_FILES
+    )
+
+
+def split_ratios(counts):
+    total = sum(counts.values()) or 1
+    return {name: round(count / total, 4) for name, count in counts.items()}
+
+
+def count_lines(path: Path) -> int:
+    count = 0
+    with path.open("rb") as handle:
+        while chunk := handle.read(HASH_CHUNK_BYTES):
+            count += chunk.count(b"\n")
+    return count
+
+
+def existing_split_counts(manifest, split_paths):
+    """Rows already in each split, from the manifest or (older manifests) the JSONL files."""
+    counts = manifest.previous_state("split_counts")
+    if counts is None:
+        counts = {name: count_lines(path) for name, path in split_paths.items()}
+    return counts
+
+
+def report_split_counts(run, manifest, counts, previous=None):
+    """Print and record split sizes/ratios of the resulting dataset.
+
+    An appended run passes the `previous` sizes; its ratios then cover the merged
+    splits, and the rows it added are reported separately.
+    """
+    totals = counts
+    if previous is not None:
+        totals = {name: previous.get(name, 0) + count for name, count in counts.items()}
+        print(f"Appended rows: {counts} (ratios {split_ratios(counts)})")
+        run.set(appended_counts=counts)
+    print(f"Split ratios: {split_ratios(totals)} over {sum(totals.values())} rows")
+    run.set(split_counts=totals, split_ratios=split_ratios(totals))
+    manifest.state["split_counts"] = totals
+
+
 def clean_text(text):
     if text is None:
         return ""
@@ -88,30 +209,149 @@ def should_drop_deleted(text):
     return lowered in {"[deleted]", "[removed]"}
 
 
-def normalize_records(dataset, prompt_field, response_field, source_name, include_metadata):
-    def _map(example):
-        prompt = clean_text(example[prompt_field]) if prompt_field else ""
-        response = clean_text(example[response_field])
+def build_record(example, prompt, response, source_name, include_metadata):
+    record = {
+        "prompt": prompt.strip(),
+        "response": response.strip(),
+        "source": source_name,
+    }
+
+    if include_metadata:
+        metadata = {}
+        for key in METADATA_KEYS:
+            if key in example and example[key] not in (None, ""):
+                metadata[key] = example[key]
+        record["metadata"] = metadata
+
+    return record
+
+
+def passes_filters(prompt, response, has_prompt, args):
+    if not response:
+        return False
+    if not args.keep_deleted and should_drop_deleted(response):
+        return False
+
+    if has_prompt:
+        if len(prompt) < args.min_prompt_chars:
+            return False
+        if len(prompt) > args.max_prompt_chars:
+            return False
+
+    if len(response) < args.min_response_chars:
+        return False
+    if len(response) > args.max_response_chars:
+        return False
+
+    return True
+
 
-        record = {
-            "prompt": prompt.strip(),
-            "response": response.strip(),
-            "source": source_name,
-        }
+def clean_and_flag(example, prompt_field, response_field, args):
+    """Clean a raw row once; keep the cleaned text in temp columns plus a `_keep` flag."""
+    prompt = clean_text(example[prompt_field]) if prompt_field else ""
+    response = clean_text(example[response_field])
+    return {
+        "_prompt": prompt,
+        "_response": response,
+        "_keep": passes_filters(prompt, response, bool(prompt_field), args),
+    }
 
-        if include_metadata:
-            metadata = {}
-            for key in ("score", "author", "id", "subreddit"):
-                if key in example and example[key] not in (None, ""):
-                    metadata[key] = example[key]
-            record["metadata"] = metadata
 
-        return record
+def filter_rows(dataset, prompt_field, response_field, args):
+    """Fused clean + filter pass in num_proc workers; cleaned text rides along to normalize."""
+    flagged = dataset.map(
+        clean_and_flag,
+        fn_kwargs={"prompt_field": prompt_field, "response_field": response_field, "args": args},
+        num_proc=args.num_proc,
+    )
+    flagged = flagged.filter(
+        lambda keep: keep, input_columns="_keep", batched=True, num_proc=args.num_proc
+    )
+    return flagged.remove_columns("_keep")
+
+
+def normalize_records(dataset, source_name, include_metadata):
+    # Runs per split, after make_splits, on already-cleaned text: only record assembly
+    # happens here, so the inferred metadata schema matches the per-split output.
+    def _map(example):
+        return build_record(
+            example, example["_prompt"], example["_response"], source_name, include_metadata
+        )
 
     return dataset.map(_map, remove_columns=dataset.column_names)
 
 
-def validate_schema(splits, include_metadata, sample_rows):
+def to_json_line(record):
+    # Mirror the pandas writer behind Dataset.to_json (ASCII-escaped, compact, escaped "/").
+    return json.dumps(record, ensure_ascii=True, separators=(",", ":")).replace("/", "\\/")
+
+
+def stream_splits(
+    dataset, prompt_field, response_field, source_name, include_metadata, args, output_dir, append=False
+):
+    """Clean, filter and write rows split by split without materializing the corpus.
+
+    Sources that already ship train/validation/test keep them; otherwise each row
+    of the base split is assigned 80/10/10 by a seeded random draw, or, with
+    --split_mode hash, each row of every source split by hash_split. With `append`
+    the rows are added to the existing split files.
+    """
+    counts = {name: 0 for name in SPLIT_FILES}
+    handles = {
+        name: (output_dir / filename).open("a" if append else "w", encoding="utf-8")
+        for name, filename in SPLIT_FILES.items()
+    }
+
+    if all(name in dataset for name in SPLIT_FILES):
+        sources = [(name, dataset[name]) for name in SPLIT_FILES]
+    elif args.split_mode == "hash":
+        sources = [(None, rows) for rows in dataset.values()]
+    else:
+        base_name = "train" if "train" in dataset else next(iter(dataset.keys()))
+        sources = [(None, dataset[base_name])]
+
+    rng = random.Random(args.seed)
+    try:
+        for fixed_split, rows in sources:
+            for example in rows:
+                cleaned = clean_and_flag(example, prompt_field, response_field, args)
+                if not cleaned["_keep"]:
+                    continue
+                record = build_record(
+                    example, cleaned["_prompt"], cleaned["_response"], source_name, include_metadata
+                )
+                split = fixed_split
+                if split is None and args.split_mode == "hash":
+                    key = example.get(args.split_key) if args.split_key else None
+                    split = hash_split(
+                        split_key(cleaned["_prompt"], cleaned["_response"], key), args.seed
+                    )
+                elif split is None:
+                    draw = rng.random()
+                    split = "train" if draw < 0.8 else "validation" if draw < 0.9 else "test"
+                if counts[split] < args.validate_rows:
+                    validate_record(split, record, include_metadata)
+                handles[split].write(to_json_line(record) + "\n")
+                counts[split] += 1
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    for name, count in counts.items():
+        if count == 0 and args.validate_rows > 0 and not append:
+            raise ValueError(f"Empty split detected: {name}")
+    return counts
+
+
+def remove_other_formats(output_dir, split_format):
+    # Readers pick the first split format they find, so stale files must not linger.
+    for filename in SPLIT_FILES.values():
+        for name, suffix in SPLIT_FORMATS.items():
+            if name != split_format:
+                (output_dir / filename).with_suffix(suffix).unlink(missing_ok=True)
+
+
+def validate_schema(splits, include_metadata, sample_rows, allow_empty=False):
     split_names = ["train", "validation", "test"]
     expected_columns = None
 
@@ -132,20 +372,41 @@ def validate_schema(splits, include_metadata, sample_rows):
 
     for name, split in zip(split_names, splits):
         limit = min(sample_rows, split.num_rows)
-        if limit == 0:
+        if limit == 0 and not allow_empty:
             raise ValueError(f"Empty split detected: {name}")
         subset = split.select(range(limit))
         for record in subset:
-            if not isinstance(record.get("prompt"), str):
-                raise ValueError(f"Non-string prompt in {name}")
-            if not isinstance(record.get("response"), str):
-                raise ValueError(f"Non-string response in {name}")
-            if not isinstance(record.get("source"), str):
-                raise ValueError(f"Non-string source in {name}")
-            if include_metadata:
-                metadata = record.get("metadata")
-                if metadata is not None and not isinstance(metadata, dict):
-                    raise ValueError(f"Invalid metadata type in {name}")
+            validate_record(name, record, include_metadata)
+
+
+def validate_record(name, record, include_metadata):
+    if not isinstance(record.get("prompt"), str):
+        raise ValueError(f"Non-string prompt in {name}")
+    if not isinstance(record.get("response"), str):
+        raise ValueError(f"Non-string response in {name}")
+    if not isinstance(record.get("source"), str):
+        raise ValueError(f"Non-string source in {name}")
+    if include_metadata:
+        metadata = record.get("metadata")
+        if metadata is not None and not isinstance(metadata, dict):
+            raise ValueError(f"Invalid metadata type in {name}")
+
+
+def finish_unchanged(run, manifest, split_paths):
+    print("Inputs, arguments and outputs are unchanged since the last run; nothing to do.")
+    for name in split_paths:
+        manifest.keep_output(name)
+    manifest.save()
+    run.set(incremental=UNCHANGED)
+    run.finish()
+
+
+def finish_written(run, manifest, split_paths, scratch):
+    for name, path in split_paths.items():
+        manifest.record_output(name, path)
+    manifest.save()
+    scratch.cleanup()
+    run.finish()
 
 
 def main() -> None:
@@ -217,20 +478,123 @@ def main() -> None:
         help="Number of rows per split to validate (0 to skip).",
     )
     parser.add_argument("--seed", type=int, default=42, help="Random seed for splits.")
+    parser.add_argument(
+        "--num_proc",
+        type=int,
+        default=None,
+        help="Worker processes for the fused filter/normalize pass.",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Stream rows and write splits incrementally (single process).",
+    )
+    parser.add_argument(
+        "--format",
+        choices=SPLIT_FORMATS.keys(),
+        default="jsonl",
+        help="Split file format; parquet/arrow let readers load only the columns they need.",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Drop near-duplicate responses (MinHash/LSH) before splitting.",
+    )
+    parser.add_argument(
+        "--dedup_threshold",
+        type=float,
+        default=0.8,
+        help="Estimated Jaccard similarity at or above which rows count as duplicates.",
+    )
+    parser.add_argument(
+        "--shingle_size", type=int, default=5, help="Words per shingle for MinHash."
+    )
+    parser.add_argument(
+        "--num_perm", type=int, default=128, help="MinHash permutations per signature."
+    )
+    parser.add_argument(
+        "--split_mode",
+        choices=("random", "hash"),
+        default="random",
+        help="random: seeded shuffle split; hash: stable per-row hash of content (or --split_key) and seed.",
+    )
+    parser.add_argument(
+        "--split_key",
+        default=None,
+        help="With --split_mode hash, a column to hash instead of the row content (e.g. id).",
+    )
+    add_manifest_args(parser)
+    add_profile_args(parser)
     args = parser.parse_args()
+    if args.dedup and args.streaming:
+        parser.error("--dedup needs the whole corpus and cannot be combined with --streaming")
 
     config = DATASET_CONFIGS[args.dataset]
+    output_dir = Path(args.output_dir) / args.dataset
+    run = RunProfile("download_data", output_dir, args.profile, args.profile_json)
+    manifest = StageManifest("download_data", output_dir, stage_args(args), args.force)
+    split_paths = {
+        name: (output_dir / filename).with_suffix(SPLIT_FORMATS[args.format])
+        for name, filename in SPLIT_FILES.items()
+    }
+    intact = all(manifest.output_intact(name, path) for name, path in split_paths.items())
+
+    status, offset = CHANGED, 0
     if args.local_csv:
         csv_path = Path(args.local_csv)
         if not csv_path.exists():
             raise FileNotFoundError(f"CSV not found: {csv_path}")
-        dataset = datasets.load_dataset("csv", data_files=str(csv_path))
-    elif config["hf_id"]:
-        dataset = datasets.load_dataset(config["hf_id"])
-    else:
-        raise ValueError("For redditjokes, you must provide --local_csv.")
-
-    columns = get_columns(dataset)
+        status, offset = manifest.check_input("local_csv", csv_path)
+        if status == UNCHANGED and intact:
+            finish_unchanged(run, manifest, split_paths)
+            return
+
+    # Appending is only equivalent to a rebuild when existing rows cannot move:
+    # hash splits, no corpus-wide dedup, and a format that can grow in place.
+    append = (
+        status == APPENDED
+        and intact
+        and args.split_mode == "hash"
+        and not args.dedup
+        and args.format == "jsonl"
+    )
+    if status == APPENDED and not append:
+        print("Rows were appended, but only --split_mode hash JSONL runs without --dedup "
+              "can add them in place; rebuilding all splits.")
+    scratch = tempfile.TemporaryDirectory()
+
+    with run.stage("load"):
+        if args.local_csv:
+            source = csv_path
+            features = None
+            if append:
+                source = write_tail(csv_path, offset, Path(scratch.name) / csv_path.name, keep_header=True)
+                # Reuse the full file's column types so a small delta is typed the same way.
+                state = manifest.previous_state("features")
+                features = datasets.Features.from_dict(state) if state else None
+            dataset = datasets.load_dataset(
+                "csv", data_files=str(source), streaming=args.streaming, features=features
+            )
+        elif config["hf_id"]:
+            dataset = datasets.load_dataset(config["hf_id"], streaming=args.streaming)
+        else:
+            raise ValueError("For redditjokes, you must provide --local_csv.")
+
+    if not args.local_csv and not args.streaming:
+        fingerprints = {name: split._fingerprint for name, split in dataset.items()}
+        if manifest.check_value("source", fingerprints) == UNCHANGED and intact:
+            finish_unchanged(run, manifest, split_paths)
+            return
+    first = next(iter(dataset.values()))
+    if first.features and not append:
+        manifest.state["features"] = first.features.to_dict()
+    previous_counts = None
+    if append:
+        print(f"Processing only the rows appended to {csv_path} (from byte {offset}).")
+        previous_counts = existing_split_counts(manifest, split_paths)
+    run.set(incremental=APPENDED if append else "full")
+
+    columns = peek_columns(dataset)
     if args.prompt_field is None and config["prompt_field"] is None:
         prompt_field = None
     else:
@@ -246,47 +610,90 @@ def main() -> None:
     )
     if response_field is None:
         raise ValueError(f"Response column not found in CSV. Columns: {columns}")
+    if args.split_key and args.split_key not in columns:
+        raise ValueError(f"Split key column not found: {args.split_key}. Columns: {columns}")
 
-    def is_valid(example):
-        prompt = clean_text(example[prompt_field]) if prompt_field else ""
-        response = clean_text(example[response_field])
-
-        if not response:
-            return False
-        if not args.keep_deleted and should_drop_deleted(response):
-            return False
-
-        if prompt_field:
-            if len(prompt) < args.min_prompt_chars:
-                return False
-            if len(prompt) > args.max_prompt_chars:
-                return False
-
-        if len(response) < args.min_response_chars:
-            return False
-        if len(response) > args.max_response_chars:
-            return False
-
-        return True
-
-    dataset = dataset.filter(is_valid)
-
-    train, val, test = make_splits(dataset, args.seed)
     include_metadata = not args.no_metadata
-    train = normalize_records(train, prompt_field, response_field, args.dataset, include_metadata)
-    val = normalize_records(val, prompt_field, response_field, args.dataset, include_metadata)
-    test = normalize_records(test, prompt_field, response_field, args.dataset, include_metadata)
-
-    validate_schema((train, val, test), include_metadata, args.validate_rows)
-
-    output_dir = Path(args.output_dir) / args.dataset
     ensure_dir(output_dir)
 
-    train.to_json(output_dir / "train.jsonl", orient="records", lines=True)
-    val.to_json(output_dir / "val.jsonl", orient="records", lines=True)
-    test.to_json(output_dir / "test.jsonl", orient="records", lines=True)
+    if args.streaming:
+        with run.stage("stream") as stage:
+            counts = stream_splits(
+                dataset,
+                prompt_field,
+                response_field,
+                args.dataset,
+                include_metadata,
+                args,
+                output_dir,
+                append=append,
+            )
+            stage["rows"] = sum(counts.values())
+        if args.format != "jsonl":
+            with run.stage("convert", rows=sum(counts.values())):
+                for filename in SPLIT_FILES.values():
+                    jsonl_path = output_dir / filename
+                    convert_split(jsonl_path, jsonl_path.with_suffix(SPLIT_FORMATS[args.format]))
+        remove_other_formats(output_dir, args.format)
+        if not append:
+            print(f"Streamed splits: {counts}")
+        report_split_counts(run, manifest, counts, previous_counts)
+        print(f"Saved splits to {output_dir}")
+        finish_written(run, manifest, split_paths, scratch)
+        return
+
+    with run.stage("filter") as stage:
+        stage["rows"] = sum(split.num_rows for split in dataset.values())
+        dataset = filter_rows(dataset, prompt_field, response_field, args)
+    if args.dedup:
+        with run.stage("dedup") as stage:
+            stage["rows"] = sum(split.num_rows for split in dataset.values())
+            dataset, report = dedup_splits(
+                dataset,
+                "_response",
+                threshold=args.dedup_threshold,
+                shingle_size=args.shingle_size,
+                num_perm=args.num_perm,
+                num_proc=args.num_proc,
+                seed=args.seed,
+            )
+        run.set(dedup={args.dataset: report})
+        for name, counts in report.items():
+            if name != "all" and len(report) == 2:
+                continue
+            print(
+                f"Dedup {args.dataset}/{name}: {counts['duplicates']} of {counts['rows']} rows "
+                f"are near-duplicates ({counts['rate']:.2%})"
+            )
+    with run.stage("split_normalize") as stage:
+        if args.split_mode == "hash":
+            train, val, test = make_hash_splits(dataset, args.seed, args.split_key, args.num_proc)
+        else:
+            train, val, test = make_splits(dataset, args.seed)
+        train = normalize_records(train, args.dataset, include_metadata)
+        val = normalize_records(val, args.dataset, include_metadata)
+        test = normalize_records(test, args.dataset, include_metadata)
+        stage["rows"] = train.num_rows + val.num_rows + test.num_rows
+
+    counts = {"train": train.num_rows, "validation": val.num_rows, "test": test.num_rows}
+    report_split_counts(run, manifest, counts, previous_counts)
+
+    with run.stage("validate"):
+        validate_schema((train, val, test), include_metadata, args.validate_rows, allow_empty=append)
+
+    with run.stage("write", rows=train.num_rows + val.num_rows + test.num_rows):
+        for split, filename in zip((train, val, test), SPLIT_FILES.values()):
+            if append:
+                with (output_dir / filename).open("ab") as handle:
+                    split.to_json(handle, orient="records", lines=True)
+            elif args.format == "jsonl":
+                split.to_json(output_dir / filename, orient="records", lines=True)
+            else:
+                write_columnar((output_dir / filename).with_suffix(SPLIT_FORMATS[args.format]), split)
+        remove_other_formats(output_dir, args.format)
 
     print(f"Saved splits to {output_dir}")
+    finish_written(run, manifest, split_paths, scratch)
 
 
 if __name__ == "__main__":
@@ -13,40 +13,29 @@ The same set of test prompts is used for all models to ensure fair and
 reproducible comparison.
 """
 
-import json
+import sys
 from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+from jsonl_utils import load_jsonl_parallel
+from text_metrics import distinct_ns
 
 def load_generations(path):
-    texts = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            obj = json.loads(line)
-            texts.append(obj["generation"])
-    return texts
+    return [obj["generation"] for obj in load_jsonl_parallel(Path(path), fields=["generation"])]
 
 def distinct_n(texts, n=1):
-    total_ngrams = 0
-    unique_ngrams = set()
-
-    for text in texts:
-        tokens = text.split()
-        ngrams = zip(*[tokens[i:] for i in range(n)])
-        ngrams = list(ngrams)
-
-        total_ngrams += len(ngrams)
-        unique_ngrams.update(ngrams)
-
-    if total_ngrams == 0:
-        return 0.0
-
-    return len(unique_ngrams) / total_ngrams
+    return distinct_ns([text.split() for text in texts], orders=(n,), across_documents=False)[n]
 
 if __name__ == "__main__":
     baseline_texts = load_generations("evaluation/baseline_generations_v2.jsonl")
     finetuned_texts = load_generations("evaluation/finetuned_generations_v2.jsonl")
 
-    print("Baseline Distinct-1:", distinct_n(baseline_texts, n=1))
-    print("Baseline Distinct-2:", distinct_n(baseline_texts, n=2))
+    baseline = distinct_ns([t.split() for t in baseline_texts], orders=(1, 2), across_documents=False)
+    finetuned = distinct_ns([t.split() for t in finetuned_texts], orders=(1, 2), across_documents=False)
+
+    print("Baseline Distinct-1:", baseline[1])
+    print("Baseline Distinct-2:", baseline[2])
 
-    print("Finetuned Distinct-1:", distinct_n(finetuned_texts, n=1))
-    print("Finetuned Distinct-2:", distinct_n(finetuned_texts, n=2))
+    print("Finetuned Distinct-1:", finetuned[1])
+    print("Finetuned Distinct-2:", finetuned[2])
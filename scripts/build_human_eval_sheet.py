@@ -2,7 +2,8 @@ import argparse
 import csv
 from pathlib import Path
 
-from jsonl_utils import load_jsonl
+from instrumentation import RunProfile, add_profile_args
+from prompt_join import join_by_prompt
 
 
 def main():
@@ -16,13 +17,9 @@ def main():
         default="docs/human_eval_template.csv",
         help="Path to output CSV.",
     )
+    add_profile_args(parser)
     args = parser.parse_args()
 
-    baseline_records = list(load_jsonl(Path(args.baseline)))
-    tuned_records = list(load_jsonl(Path(args.tuned)))
-
-    tuned_by_prompt = {r.get("prompt", ""): r.get("response", "") for r in tuned_records}
-
     output_path = Path(args.output)
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -39,13 +36,17 @@ def main():
         "date",
     ]
 
-    with output_path.open("w", encoding="utf-8", newline="") as handle:
+    run = RunProfile("build_human_eval_sheet", output_path, args.profile, args.profile_json)
+    with run.stage("join_and_write") as stage, output_path.open(
+        "w", encoding="utf-8", newline=""
+    ) as handle:
         writer = csv.DictWriter(handle, fieldnames=fieldnames)
         writer.writeheader()
-        for record in baseline_records:
+        stage["rows"] = 0
+        for record, match in join_by_prompt(Path(args.baseline), Path(args.tuned)):
             prompt = record.get("prompt", "")
             baseline = record.get("response", "")
-            tuned = tuned_by_prompt.get(prompt, "")
+            tuned = match.get("response", "") if match is not None else ""
             writer.writerow(
                 {
                     "prompt": prompt,
@@ -60,8 +61,10 @@ def main():
                     "date": "",
                 }
             )
+            stage["rows"] += 1
 
     print(f"Wrote template to {output_path}")
+    run.finish()
 
 
 if __name__ == "__main__":
@@ -1,8 +1,31 @@
 import argparse
 import csv
+import heapq
 from pathlib import Path
 
-from jsonl_utils import load_jsonl
+from instrumentation import RunProfile, add_profile_args
+from prompt_join import join_by_prompt
+
+
+def iter_rows(pairs):
+    for record, match in pairs:
+        prompt = record.get("prompt", "")
+        base = record.get("response", "")
+        tune = match.get("response", "") if match is not None else ""
+        if not isinstance(base, str) or not isinstance(tune, str):
+            continue
+        yield {
+            "prompt": prompt,
+            "baseline_response": base,
+            "tuned_response": tune,
+            "baseline_len": len(base),
+            "tuned_len": len(tune),
+            "delta_len": len(tune) - len(base),
+        }
+
+
+def delta_key(row):
+    return abs(row["delta_len"])
 
 
 def main():
@@ -17,37 +40,24 @@ def main():
         help="Path to output CSV.",
     )
     parser.add_argument("--top_n", type=int, default=20, help="Rows to export.")
+    add_profile_args(parser)
     args = parser.parse_args()
 
-    baseline = list(load_jsonl(Path(args.baseline)))
-    tuned = list(load_jsonl(Path(args.tuned)))
-
-    tuned_by_prompt = {r.get("prompt", ""): r.get("response", "") for r in tuned}
-    rows = []
-    for record in baseline:
-        prompt = record.get("prompt", "")
-        base = record.get("response", "")
-        tune = tuned_by_prompt.get(prompt, "")
-        if not isinstance(base, str) or not isinstance(tune, str):
-            continue
-        rows.append(
-            {
-                "prompt": prompt,
-                "baseline_response": base,
-                "tuned_response": tune,
-                "baseline_len": len(base),
-                "tuned_len": len(tune),
-                "delta_len": len(tune) - len(base),
-            }
-        )
-
-    rows.sort(key=lambda r: abs(r["delta_len"]), reverse=True)
-    if args.top_n > 0:
-        rows = rows[: args.top_n]
+    run = RunProfile("compare_outputs", args.output, args.profile, args.profile_json)
+    with run.stage("join") as stage:
+        rows = iter_rows(join_by_prompt(Path(args.baseline), Path(args.tuned)))
+        if args.top_n > 0:
+            # Bounded heap; same order as a stable descending sort truncated to top_n.
+            rows = heapq.nlargest(args.top_n, rows, key=delta_key)
+        else:
+            rows = sorted(rows, key=delta_key, reverse=True)
+        stage["rows"] = len(rows)
 
     output_path = Path(args.output)
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with output_path.open("w", encoding="utf-8", newline="") as handle:
+    with run.stage("write", rows=len(rows)), output_path.open(
+        "w", encoding="utf-8", newline=""
+    ) as handle:
         writer = csv.DictWriter(
             handle,
             fieldnames=[
@@ -63,6 +73,7 @@ def main():
         writer.writerows(rows)
 
     print(f"Wrote {len(rows)} rows to {output_path}")
+    run.finish()
 
 
 if __name__ == "__main__":
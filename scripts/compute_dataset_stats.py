@@ -1,39 +1,127 @@
 import argparse
-import json
+import math
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import find_split, load_jsonl
+from pipeline_manifest import (
+    APPENDED,
+    UNCHANGED,
+    StageManifest,
+    add_manifest_args,
+    stage_args,
+)
 
-def load_jsonl(path: Path):
-    with path.open("r", encoding="utf-8") as handle:
-        for line in handle:
-            line = line.strip()
-            if not line:
-                continue
-            yield json.loads(line)
+
+SPLIT_NAMES = ("train", "val", "test")
 
 
 def tokenize(text: str):
     return [t for t in text.split() if t]
 
 
-def compute_stats(path: Path, field: str):
-    lengths = []
-    for record in load_jsonl(path):
+class LengthStats:
+    """Constant-memory, mergeable accumulator for token-length statistics.
+
+    Lengths are integers, so an exact count per distinct length acts as the
+    quantile sketch: its size is bounded by the longest record, not the row
+    count, and merging two accumulators is a counter sum.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.lengths = Counter()
+
+    def add(self, length: int) -> None:
+        self.count += 1
+        self.total += length
+        self.lengths[length] += 1
+
+    def merge(self, other: "LengthStats") -> "LengthStats":
+        self.count += other.count
+        self.total += other.total
+        self.lengths.update(other.lengths)
+        return self
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "lengths": {str(length): count for length, count in sorted(self.lengths.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data) -> "LengthStats":
+        stats = cls()
+        stats.count = data["count"]
+        stats.total = data["total"]
+        stats.lengths = Counter({int(length): count for length, count in data["lengths"].items()})
+        return stats
+
+    def quantile(self, q: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for length in sorted(self.lengths):
+            seen += self.lengths[length]
+            if seen >= rank:
+                return length
+        return max(self.lengths)
+
+    def histogram(self, bin_width: int):
+        bins = Counter()
+        for length, count in self.lengths.items():
+            bins[length // bin_width] += count
+        return bins
+
+    def summary(self):
+        if not self.count:
+            return dict(EMPTY_STATS)
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 2),
+            "min": min(self.lengths),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": max(self.lengths),
+        }
+
+
+EMPTY_STATS = {"count": 0, "avg": 0, "min": 0, "p50": 0, "p90": 0, "p99": 0, "max": 0}
+
+
+def compute_stats(path: Path, field: str, start: int = 0) -> LengthStats:
+    stats = LengthStats()
+    for record in load_jsonl(path, fields=[field], start=start):
         value = record.get(field, "")
         if not isinstance(value, str):
             continue
-        tokens = tokenize(value)
-        lengths.append(len(tokens))
+        stats.add(len(tokenize(value)))
+    return stats
+
 
-    if not lengths:
-        return {"count": 0, "avg": 0, "min": 0, "max": 0}
+def compute_all_stats(splits, field: str, workers=None, starts=None):
+    """Accumulate each split in its own worker process and return per-split stats.
 
-    return {
-        "count": len(lengths),
-        "avg": round(sum(lengths) / len(lengths), 2),
-        "min": min(lengths),
-        "max": max(lengths),
-    }
+    `starts` maps a split to the byte offset to read from (default: the whole file).
+    """
+    names = list(splits)
+    if not names:
+        return {}
+    starts = starts or {}
+    with ProcessPoolExecutor(max_workers=workers or len(names)) as pool:
+        results = pool.map(
+            compute_stats,
+            [splits[name] for name in names],
+            [field] * len(names),
+            [starts.get(name, 0) for name in names],
+        )
+        return dict(zip(names, results))
 
 
 def build_summary(stats, min_target, max_target):
@@ -59,7 +147,11 @@ def build_summary(stats, min_target, max_target):
     )
 
 
-def write_markdown(output_path: Path, stats, field, min_target, max_target):
+def split_label(split):
+    return "Validation" if split == "val" else split.capitalize()
+
+
+def write_markdown(output_path: Path, stats, field, min_target, max_target, accumulators=None, bin_width=50):
     output_path.parent.mkdir(parents=True, exist_ok=True)
     lines = [
         "## Dataset stats (W1)",
@@ -70,16 +162,34 @@ def write_markdown(output_path: Path, stats, field, min_target, max_target):
         "",
         "### Current splits",
         "",
-        "| Split | Samples | Avg tokens | Min tokens | Max tokens |",
-        "| --- | --- | --- | --- | --- |",
+        "| Split | Samples | Avg tokens | Min tokens | P50 | P90 | P99 | Max tokens |",
+        "| --- | --- | --- | --- | --- | --- | --- | --- |",
     ]
 
-    for split in ("train", "val", "test"):
-        data = stats.get(split, {"count": 0, "avg": 0, "min": 0, "max": 0})
-        name = "Validation" if split == "val" else split.capitalize()
+    for split in list(SPLIT_NAMES) + (["all"] if "all" in stats else []):
+        data = {**EMPTY_STATS, **stats.get(split, {})}
         lines.append(
-            f"| {name} | {data['count']} | {data['avg']:.2f} | {data['min']} | {data['max']} |"
+            f"| {split_label(split)} | {data['count']} | {data['avg']:.2f} | {data['min']} "
+            f"| {data['p50']} | {data['p90']} | {data['p99']} | {data['max']} |"
+        )
+
+    if accumulators:
+        histograms = {split: acc.histogram(bin_width) for split, acc in accumulators.items()}
+        all_bins = sorted(set().union(*histograms.values()))
+        names = [split for split in SPLIT_NAMES if split in histograms]
+        lines.extend(
+            [
+                "",
+                f"### Length histogram ({bin_width}-token bins)",
+                "",
+                "| Tokens | " + " | ".join(split_label(split) for split in names) + " |",
+                "| --- | " + " | ".join("---" for _ in names) + " |",
+            ]
         )
+        for bucket in all_bins:
+            low = bucket * bin_width
+            counts = " | ".join(str(histograms[split].get(bucket, 0)) for split in names)
+            lines.append(f"| {low}-{low + bin_width - 1} | {counts} |")
 
     lines.extend(
         [
@@ -101,7 +211,7 @@ def main():
     parser.add_argument(
         "--input_dir",
         default="data/raw",
-        help="Folder containing dataset splits (train/val/test.jsonl).",
+        help="Folder containing dataset splits (train/val/test .jsonl, .parquet or .arrow).",
     )
     parser.add_argument(
         "--dataset",
@@ -120,22 +230,74 @@ def main():
     )
     parser.add_argument("--min_target", type=int, default=50)
     parser.add_argument("--max_target", type=int, default=300)
+    parser.add_argument(
+        "--bin_width", type=int, default=50, help="Token bin width for histograms."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Worker processes (default: one per split)."
+    )
+    add_manifest_args(parser)
+    add_profile_args(parser)
     args = parser.parse_args()
 
     input_root = Path(args.input_dir) / args.dataset
-    splits = {
-        "train": input_root / "train.jsonl",
-        "val": input_root / "val.jsonl",
-        "test": input_root / "test.jsonl",
-    }
+    splits = {split: find_split(input_root, split) for split in SPLIT_NAMES}
 
     for split, path in splits.items():
         if not path.exists():
             raise SystemExit(f"Missing split: {split} at {path}")
 
-    stats = {split: compute_stats(path, args.field) for split, path in splits.items()}
-    write_markdown(Path(args.output), stats, args.field, args.min_target, args.max_target)
+    run = RunProfile("compute_dataset_stats", args.output, args.profile, args.profile_json)
+    manifest = StageManifest("compute_dataset_stats", args.output, stage_args(args), args.force)
+    statuses = {split: manifest.check_input(split, path) for split, path in splits.items()}
+    if manifest.output_intact("markdown", Path(args.output)) and all(
+        status == UNCHANGED for status, _ in statuses.values()
+    ):
+        print("Splits, arguments and output are unchanged since the last run; nothing to do.")
+        manifest.keep_output("markdown")
+        manifest.save()
+        run.finish()
+        return
+
+    # Stored accumulators cover unchanged splits entirely and appended ones up to
+    # their old end, so only new rows are tokenized.
+    accumulators = {}
+    pending = {}
+    starts = {}
+    for split, (status, offset) in statuses.items():
+        stored = manifest.previous_state(split)
+        if stored is not None and status in (UNCHANGED, APPENDED):
+            accumulators[split] = LengthStats.from_dict(stored)
+        if stored is None or status != UNCHANGED:
+            pending[split] = splits[split]
+            starts[split] = offset if stored is not None and status == APPENDED else 0
+    with run.stage("tokenize") as stage:
+        fresh = compute_all_stats(pending, args.field, args.workers, starts)
+        stage["rows"] = sum(acc.count for acc in fresh.values())
+    for split, acc in fresh.items():
+        accumulators[split] = accumulators.get(split, LengthStats()).merge(acc)
+    accumulators = {split: accumulators[split] for split in SPLIT_NAMES}
+    for split, acc in accumulators.items():
+        manifest.state[split] = acc.to_dict()
+    total = LengthStats()
+    for acc in accumulators.values():
+        total.merge(acc)
+    stats = {split: acc.summary() for split, acc in accumulators.items()}
+    stats["all"] = total.summary()
+    with run.stage("write"):
+        write_markdown(
+            Path(args.output),
+            stats,
+            args.field,
+            args.min_target,
+            args.max_target,
+            accumulators=accumulators,
+            bin_width=args.bin_width,
+        )
     print(f"Wrote stats to {args.output}")
+    manifest.record_output("markdown", Path(args.output))
+    manifest.save()
+    run.finish()
 
 
 if __name__ == "__main__":
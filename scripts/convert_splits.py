@@ -0,0 +1,71 @@
+import argparse
+from itertools import zip_longest
+from pathlib import Path
+
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import SPLIT_FORMATS, convert_split, load_jsonl
+
+
+def split_files(path: Path):
+    if path.is_file():
+        return [path]
+    suffixes = set(SPLIT_FORMATS.values())
+    return sorted(p for p in path.iterdir() if p.suffix in suffixes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert dataset splits between JSONL, Parquet and Arrow (lossless)."
+    )
+    parser.add_argument("--input", required=True, help="A split file or a folder of splits.")
+    parser.add_argument(
+        "--format", choices=SPLIT_FORMATS.keys(), required=True, help="Target format."
+    )
+    parser.add_argument(
+        "--output_dir",
+        default=None,
+        help="Where to write converted files (default: next to the input).",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Re-read both files and check every row round-tripped unchanged.",
+    )
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    input_path = Path(args.input)
+    if not input_path.exists():
+        raise SystemExit(f"Input not found: {input_path}")
+    suffix = SPLIT_FORMATS[args.format]
+    sources = [p for p in split_files(input_path) if p.suffix != suffix]
+    if not sources:
+        raise SystemExit(f"No splits to convert in: {input_path}")
+
+    def target_for(source):
+        output_dir = Path(args.output_dir) if args.output_dir else source.parent
+        return output_dir / f"{source.stem}{suffix}"
+
+    # One file: the profile sits next to the converted file, else in the output folder.
+    if input_path.is_file():
+        profile_output = target_for(input_path)
+    else:
+        profile_output = Path(args.output_dir) if args.output_dir else input_path
+    run = RunProfile("convert_splits", profile_output, args.profile, args.profile_json)
+    for source in sources:
+        target = target_for(source)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with run.stage(f"convert:{source.name}") as stage:
+            count = stage["rows"] = convert_split(source, target)
+        print(f"{source.name}: {count} rows -> {target}")
+        if args.verify:
+            with run.stage(f"verify:{source.name}", rows=count):
+                pairs = zip_longest(load_jsonl(source), load_jsonl(target), fillvalue={})
+                if any(a != b or list(a) != list(b) for a, b in pairs):
+                    raise SystemExit(f"Round trip changed rows: {source} -> {target}")
+            print("  verified")
+    run.finish()
+
+
+if __name__ == "__main__":
+    main()
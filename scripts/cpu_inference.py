@@ -0,0 +1,119 @@
+import hashlib
+import io
+import os
+import re
+import warnings
+from pathlib import Path
+
+from generation_cache import model_fingerprint
+
+QUANTIZE_MODES = ("none", "int8")
+
+
+def add_inference_args(parser):
+    parser.add_argument(
+        "--quantize",
+        choices=QUANTIZE_MODES,
+        default="none",
+        help="int8: dynamic int8 quantization of the linear layers (CPU only).",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="Wrap the model forward in torch.compile (first batches pay the compile cost).",
+    )
+    parser.add_argument(
+        "--quantized_dir",
+        default=".cache/quantized",
+        help="Where converted int8 models are cached so later runs skip the conversion.",
+    )
+
+
+def conv1d_to_linear(model):
+    """Swap transformers Conv1D layers (GPT-2 projections) for equivalent nn.Linear.
+
+    Conv1D stores its weight as [in, out]; dynamic quantization only handles
+    nn.Linear, so the weight is transposed into a Linear with the same output.
+    """
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features, device=child.weight.device)
+                linear.weight = torch.nn.Parameter(child.weight.detach().t().contiguous())
+                linear.bias = child.bias
+                setattr(module, name, linear)
+    return model
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of every Linear (weights int8, activations per batch)."""
+    import torch
+
+    conv1d_to_linear(model)
+    with warnings.catch_warnings():
+        # Eager-mode quantization is deprecated in favour of torchao but still shipped.
+        warnings.simplefilter("ignore")
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def model_size_mb(model):
+    """Serialized state_dict size; counts packed int8 weights that parameters() misses."""
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+
+def quantized_cache_path(model_id, quantized_dir, mode="int8"):
+    import torch
+    import transformers
+    from transformers import AutoConfig
+
+    config = AutoConfig.from_pretrained(model_id)
+    key = "|".join(
+        [model_fingerprint(model_id, config), mode, torch.__version__, transformers.__version__]
+    )
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_id.strip("/"))[-60:]
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return Path(quantized_dir) / f"{slug}-{mode}-{digest}.pt"
+
+
+def load_for_inference(loader, model_id, device, args):
+    """Load through `loader(model_id, device)` and apply --quantize / --compile.
+
+    The int8 (tokenizer, model) pair is pickled to --quantized_dir, keyed by the
+    weights fingerprint and the torch/transformers versions, so later runs load
+    it directly instead of loading fp32 weights and converting them again. The
+    cache is a trusted local artifact: it is read with torch.load(weights_only=False).
+    """
+    import torch
+
+    if args.quantize == "none":
+        tokenizer, model = loader(model_id, device)
+    elif device != "cpu":
+        raise SystemExit("--quantize int8 uses CPU-only kernels; run without a GPU.")
+    else:
+        path = quantized_cache_path(model_id, args.quantized_dir, args.quantize)
+        if path.exists():
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                tokenizer, model = torch.load(path, weights_only=False)
+            print(f"Loaded {args.quantize} model from {path}")
+        else:
+            tokenizer, model = loader(model_id, device)
+            model = quantize_int8(model)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename, so parallel workers never read a partial file.
+            partial = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            torch.save((tokenizer, model), partial)
+            os.replace(partial, path)
+            print(f"Cached {args.quantize} model to {path}")
+        model.eval()
+    if args.compile:
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return tokenizer, model
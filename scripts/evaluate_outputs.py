@@ -3,11 +3,16 @@ import json
 from collections import Counter
 from pathlib import Path
 
-from jsonl_utils import load_jsonl
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import load_jsonl_parallel
+from text_metrics import distinct_ns
+
+
+RESPONSE_FIELDS = ("response", "output", "text")
 
 
 def pick_response_field(record):
-    for key in ("response", "output", "text"):
+    for key in RESPONSE_FIELDS:
         if key in record and isinstance(record[key], str):
             return key
     return None
@@ -17,13 +22,6 @@ def tokenize(text: str):
     return [t for t in text.strip().split() if t]
 
 
-def distinct_n(tokens, n):
-    if len(tokens) < n or n <= 0:
-        return 0.0
-    ngrams = [tuple(tokens[i : i + n]) for i in range(len(tokens) - n + 1)]
-    return len(set(ngrams)) / max(1, len(ngrams))
-
-
 def compute_metrics(records, min_chars):
     responses = []
     for record in records:
@@ -45,7 +43,7 @@ def compute_metrics(records, min_chars):
         }
 
     token_lists = [tokenize(text) for text in responses]
-    all_tokens = [t for tokens in token_lists for t in tokens]
+    distinct = distinct_ns(token_lists, orders=(1, 2), across_documents=True)
 
     avg_chars = sum(len(t) for t in responses) / len(responses)
     avg_tokens = sum(len(t) for t in token_lists) / len(token_lists)
@@ -53,8 +51,8 @@ def compute_metrics(records, min_chars):
         "count": len(responses),
         "avg_chars": round(avg_chars, 2),
         "avg_tokens": round(avg_tokens, 2),
-        "distinct_1": round(distinct_n(all_tokens, 1), 4),
-        "distinct_2": round(distinct_n(all_tokens, 2), 4),
+        "distinct_1": round(distinct[1], 4),
+        "distinct_2": round(distinct[2], 4),
     }
 
 
@@ -75,20 +73,27 @@ def main():
         default=None,
         help="Optional path to write JSON report.",
     )
+    add_profile_args(parser)
     args = parser.parse_args()
 
-    baseline_records = list(load_jsonl(Path(args.baseline)))
-    report = {"baseline": compute_metrics(baseline_records, args.min_chars)}
+    run = RunProfile("evaluate_outputs", args.report, args.profile, args.profile_json)
+    with run.stage("baseline") as stage:
+        baseline_records = load_jsonl_parallel(Path(args.baseline), fields=RESPONSE_FIELDS)
+        report = {"baseline": compute_metrics(baseline_records, args.min_chars)}
+        stage["rows"] = report["baseline"]["count"]
 
     if args.tuned:
-        tuned_records = list(load_jsonl(Path(args.tuned)))
-        report["tuned"] = compute_metrics(tuned_records, args.min_chars)
+        with run.stage("tuned") as stage:
+            tuned_records = load_jsonl_parallel(Path(args.tuned), fields=RESPONSE_FIELDS)
+            report["tuned"] = compute_metrics(tuned_records, args.min_chars)
+            stage["rows"] = report["tuned"]["count"]
 
     print(json.dumps(report, indent=2))
     if args.report:
         Path(args.report).parent.mkdir(parents=True, exist_ok=True)
         with Path(args.report).open("w", encoding="utf-8") as handle:
             json.dump(report, handle, indent=2)
+    run.finish()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,41 @@
 import argparse
 from pathlib import Path
 
-from jsonl_utils import load_jsonl, write_jsonl
+from cpu_inference import add_inference_args, load_for_inference
+from generation_cache import add_cache_args, open_cache
+from generation_engine import GenerationStats, PrefixKVCache, iter_generate
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import (
+    JsonlAppendWriter,
+    load_jsonl_parallel,
+    load_prompt_keys,
+    skip_completed,
+)
+from model_loading import import_model_stack, load_tokenizer, load_weights, report_startup
+from stopping import StopConfig, add_stopping_args
+
+
+def collect_prompts(records, prompt_field, fallback_field):
+    prompts = []
+    for record in records:
+        prompt = record.get(prompt_field, "")
+        if not isinstance(prompt, str) or not prompt.strip():
+            fallback = fallback_field or ""
+            prompt = record.get(fallback, "") if fallback else ""
+        if not isinstance(prompt, str) or not prompt.strip():
+            continue
+        prompts.append(prompt)
+    return prompts
+
+
+def load_model(model_id, device):
+    from transformers import AutoModelForCausalLM
+
+    tokenizer = load_tokenizer(model_id)
+    model = load_weights(AutoModelForCausalLM, model_id)
+    model.to(device)
+    model.eval()
+    return tokenizer, model
 
 
 def main():
@@ -34,50 +68,103 @@ def main():
     parser.add_argument("--temperature", type=float, default=0.8)
     parser.add_argument("--top_p", type=float, default=0.95)
     parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=8,
+        help="Prompts per generate call (prompts are bucketed by token length).",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Append to an existing output and skip prompts that already have a row.",
+    )
+    parser.add_argument(
+        "--fsync_every", type=int, default=50, help="Rows between fsync calls."
+    )
+    parser.add_argument(
+        "--prefix_cache",
+        action="store_true",
+        help="Prefill the prompt prefix shared by each batch once and reuse its KV cache.",
+    )
+    parser.add_argument(
+        "--min_prefix_tokens",
+        type=int,
+        default=4,
+        help="Shortest shared prefix worth caching.",
+    )
+    add_cache_args(parser)
+    add_inference_args(parser)
+    add_stopping_args(parser)
+    add_profile_args(parser)
     args = parser.parse_args()
 
-    try:
-        from transformers import pipeline, set_seed
-    except ImportError as exc:
-        raise SystemExit(
-            "Missing dependency: transformers. Install with:\n"
-            "pip install transformers torch"
-        ) from exc
-
-    records = list(load_jsonl(Path(args.input)))
+    run = RunProfile("generate_outputs", args.output, args.profile, args.profile_json)
+    with run.stage("import"):
+        torch, transformers = import_model_stack()
+    with run.stage("load_input") as stage:
+        fields = [name for name in (args.prompt_field, args.fallback_field) if name]
+        records = list(load_jsonl_parallel(Path(args.input), fields=fields))
+        stage["rows"] = len(records)
     if not records:
         raise SystemExit("Input file is empty.")
 
     if args.max_rows > 0:
         records = records[: args.max_rows]
 
-    set_seed(args.seed)
-    generator = pipeline(
-        "text-generation",
-        model=args.model_id,
+    prompts = collect_prompts(records, args.prompt_field, args.fallback_field)
+
+    output_path = Path(args.output)
+    completed = load_prompt_keys(output_path) if args.resume else None
+    pending = skip_completed(prompts, completed) if completed else list(range(len(prompts)))
+    if len(pending) < len(prompts):
+        print(f"Resuming: {len(prompts) - len(pending)} prompts already done")
+    prompts = [prompts[i] for i in pending]
+
+    transformers.set_seed(args.seed)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    with run.stage("load_model"):
+        tokenizer, model = load_for_inference(load_model, args.model_id, device, args)
+    cache = open_cache(args, args.model_id, model, args.seed)
+    prefix_cache = (
+        PrefixKVCache(model, device, args.min_prefix_tokens) if args.prefix_cache else None
     )
 
-    outputs = []
-    for record in records:
-        prompt = record.get(args.prompt_field, "")
-        if not isinstance(prompt, str) or not prompt.strip():
-            fallback = args.fallback_field or ""
-            prompt = record.get(fallback, "") if fallback else ""
-        if not isinstance(prompt, str) or not prompt.strip():
-            continue
-        result = generator(
-            prompt,
+    stats = GenerationStats()
+    stopping = StopConfig.from_args(args)
+    with run.stage("generate") as stage, JsonlAppendWriter(
+        output_path, append=args.resume, fsync_every=args.fsync_every
+    ) as writer:
+        for index, continuation in iter_generate(
+            model,
+            tokenizer,
+            prompts,
+            batch_size=args.batch_size,
             max_new_tokens=args.max_new_tokens,
             temperature=args.temperature,
             top_p=args.top_p,
             do_sample=True,
-            num_return_sequences=1,
-        )[0]["generated_text"]
-        outputs.append({"prompt": prompt, "response": result})
-
-    write_jsonl(Path(args.output), outputs)
-    print(f"Wrote {len(outputs)} rows to {args.output}")
+            device=device,
+            stats=stats,
+            window=args.batch_size * 16,
+            cache=cache,
+            prefix_cache=prefix_cache,
+            stopping=stopping,
+        ):
+            record = {"prompt": prompts[index], "response": prompts[index] + continuation}
+            if stopping:
+                record["stop_reason"] = stats.row_stop_reasons.pop(index)
+            writer.write(record)
+        stage["rows"] = len(prompts)
 
+    print(f"Wrote {writer.count} rows to {args.output}")
+    stats.report()
+    report_startup(run, stats.first_token_at)
+    if cache is not None:
+        cache.report()
+        cache.close()
+    run.set(generation=stats.summary())
+    run.finish()
 
 if __name__ == "__main__":
     main()
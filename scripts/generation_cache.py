@@ -0,0 +1,127 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth")
+
+
+def model_fingerprint(model_id: str, model=None) -> str:
+    """Identify the exact weights behind a model id.
+
+    Local checkpoints are fingerprinted by weight file names, sizes and mtimes;
+    hub models by the resolved commit hash when transformers exposes it. `model`
+    may also be just its config.
+    """
+    path = Path(model_id)
+    parts = [model_id]
+    if path.is_dir():
+        for weight_file in sorted(path.rglob("*")):
+            if weight_file.suffix in WEIGHT_SUFFIXES:
+                stat = weight_file.stat()
+                parts.append(f"{weight_file.relative_to(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    elif model is not None:
+        commit = getattr(getattr(model, "config", model), "_commit_hash", None)
+        if commit:
+            parts.append(commit)
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """SQLite-backed prompt -> continuation cache with LRU eviction by size."""
+
+    def __init__(self, cache_dir: Path, namespace: str, max_bytes: int = 512 * 1024 * 1024):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(str(cache_dir / "generations.sqlite"))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS generations_lru ON generations(last_access)"
+        )
+        self._conn.commit()
+
+    def key(self, prompt: str, params) -> str:
+        payload = json.dumps([self.namespace, params, prompt], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        row = self._conn.execute(
+            "SELECT value FROM generations WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._conn.execute(
+            "UPDATE generations SET last_access = ? WHERE key = ?", (time.time(), key)
+        )
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        size = len(key) + len(value.encode("utf-8"))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO generations (key, value, size, last_access) "
+            "VALUES (?, ?, ?, ?)",
+            (key, value, size, time.time()),
+        )
+
+    def commit(self) -> None:
+        self.evict()
+        self._conn.commit()
+
+    def evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        stale = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM generations ORDER BY last_access ASC"
+        ):
+            stale.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        self._conn.executemany("DELETE FROM generations WHERE key = ?", stale)
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+    def report(self) -> None:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        print(f"Cache: {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate)")
+
+
+def add_cache_args(parser) -> None:
+    parser.add_argument(
+        "--cache_dir",
+        default=".cache/generations",
+        help="Directory for the persistent generation cache.",
+    )
+    parser.add_argument(
+        "--no_cache", action="store_true", help="Disable the generation cache."
+    )
+    parser.add_argument(
+        "--cache_max_mb", type=int, default=512, help="Cache size cap before LRU eviction."
+    )
+
+
+def open_cache(args, model_id: str, model, seed):
+    if args.no_cache:
+        return None
+    namespace = f"{model_fingerprint(model_id, model)}:seed={seed}"
+    quantize = getattr(args, "quantize", "none")
+    if quantize != "none":
+        # Quantized weights generate different text than the fp32 checkpoint.
+        namespace += f":quantize={quantize}"
+    return GenerationCache(Path(args.cache_dir), namespace, args.cache_max_mb * 1024 * 1024)
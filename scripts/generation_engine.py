@@ -0,0 +1,333 @@
+import copy
+import json
+import time
+from collections import Counter, OrderedDict
+
+from stopping import RowStopper, trim_stop_string
+
+
+class GenerationStats:
+    def __init__(self):
+        self.prompts = 0
+        self.batches = 0
+        self.prompt_tokens = 0
+        self.new_tokens = 0
+        self.prefill_tokens_saved = 0
+        self.prefill_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.elapsed = 0.0
+        # perf_counter() when the first prefill finished (the first token exists).
+        self.first_token_at = None
+        # Filled only when a StopConfig is given: why each row ended and the
+        # per-row decode budget (tokens) and batch decode steps it left unused.
+        self.stop_reasons = Counter()
+        self.row_stop_reasons = {}
+        self.tokens_saved = 0
+        self.decode_steps_saved = 0
+
+    def summary(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return {
+            "prompts": self.prompts,
+            "batches": self.batches,
+            "prompt_tokens": self.prompt_tokens,
+            "new_tokens": self.new_tokens,
+            "prefill_tokens_saved": self.prefill_tokens_saved,
+            "seconds": round(self.elapsed, 3),
+            "prefill_seconds": round(self.prefill_seconds, 3),
+            "decode_seconds": round(self.decode_seconds, 3),
+            "stop_reasons": dict(self.stop_reasons),
+            "tokens_saved": self.tokens_saved,
+            "decode_steps_saved": self.decode_steps_saved,
+            "prompts_per_sec": round(self.prompts / elapsed, 2),
+            "tokens_per_sec": round(self.new_tokens / elapsed, 2),
+        }
+
+    def report(self):
+        data = self.summary()
+        print(
+            f"Generated {data['prompts']} prompts in {data['batches']} batches "
+            f"({data['seconds']}s): {data['prompts_per_sec']} prompts/sec, "
+            f"{data['tokens_per_sec']} tokens/sec "
+            f"(prefill {data['prefill_seconds']}s, decode {data['decode_seconds']}s)"
+        )
+        if data["prefill_tokens_saved"]:
+            print(f"Prefix cache saved {data['prefill_tokens_saved']} prefill tokens")
+        if data["stop_reasons"]:
+            reasons = ", ".join(
+                f"{name} {count}" for name, count in sorted(data["stop_reasons"].items())
+            )
+            print(
+                f"Stop reasons: {reasons}; early stops saved {data['tokens_saved']} tokens "
+                f"of row budget and {data['decode_steps_saved']} batch decode steps"
+            )
+
+
+class PrefillTimer:
+    """Logits processor that records when the first (prefill) forward pass is done.
+
+    It returns the scores unchanged. Everything in a generate call up to its first
+    call is prefill, the rest is decode.
+    """
+
+    def __init__(self):
+        self.first_call = None
+
+    def reset(self):
+        self.first_call = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_call is None:
+            if scores.is_cuda:
+                import torch
+
+                torch.cuda.synchronize(scores.device)
+            self.first_call = time.perf_counter()
+        return scores
+
+
+def prepare_tokenizer(tokenizer):
+    # Decoder-only models must be padded on the left so new tokens follow the prompt.
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+
+def length_buckets(lengths, batch_size):
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    size = max(1, batch_size)
+    return [order[i : i + size] for i in range(0, len(order), size)]
+
+
+def count_new_tokens(new_ids, eos_token_id):
+    # Finished rows are padded with EOS; count up to and including the first one.
+    for position, token_id in enumerate(new_ids):
+        if token_id == eos_token_id:
+            return position + 1
+    return len(new_ids)
+
+
+def common_prefix_length(sequences):
+    """Longest shared token prefix, always leaving at least one token per row."""
+    limit = min(len(ids) for ids in sequences) - 1
+    first = sequences[0]
+    for position in range(max(limit, 0)):
+        token_id = first[position]
+        if any(ids[position] != token_id for ids in sequences[1:]):
+            return position
+    return max(limit, 0)
+
+
+def build_batch(rows, prefix_length, pad_token_id):
+    """Pad rows to one width, inserting padding between the shared prefix and the rest.
+
+    With prefix_length=0 this is plain left padding. Otherwise every row keeps the
+    prefix at positions 0..P-1, so one prefix KV cache is valid for the whole batch
+    (position ids are derived from the attention mask and skip the padding).
+    """
+    import torch
+
+    width = max(len(ids) for ids in rows)
+    input_ids = []
+    attention_mask = []
+    for ids in rows:
+        missing = width - len(ids)
+        input_ids.append(ids[:prefix_length] + [pad_token_id] * missing + ids[prefix_length:])
+        attention_mask.append([1] * prefix_length + [0] * missing + [1] * (len(ids) - prefix_length))
+    return torch.tensor(input_ids, dtype=torch.long), torch.tensor(attention_mask, dtype=torch.long)
+
+
+class PrefixKVCache:
+    """Reuse past_key_values of prompt prefixes shared by a whole batch (CPU-friendly).
+
+    The prefix is prefilled once at batch size 1 and copied across the batch; a few
+    recent prefixes are kept so repeated control prefixes are never recomputed.
+    """
+
+    def __init__(self, model, device, min_tokens=4, max_entries=8):
+        self.model = model
+        self.device = device
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def prefix_length(self, rows):
+        if len(rows) < 2:
+            return 0
+        length = common_prefix_length(rows)
+        return length if length >= self.min_tokens else 0
+
+    def past_for(self, prefix, batch_size, stats):
+        import torch
+
+        key = tuple(prefix)
+        past = self.entries.get(key)
+        if past is None:
+            with torch.no_grad():
+                output = self.model(
+                    torch.tensor([prefix], dtype=torch.long, device=self.device), use_cache=True
+                )
+            past = output.past_key_values
+            self.entries[key] = past
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            stats.prefill_tokens_saved -= len(prefix)
+        self.entries.move_to_end(key)
+        stats.prefill_tokens_saved += len(prefix) * batch_size
+        batch_past = copy.deepcopy(past)
+        if batch_size > 1:
+            batch_past.batch_repeat_interleave(batch_size)
+        return batch_past
+
+
+def iter_generate(
+    model,
+    tokenizer,
+    prompts,
+    batch_size=8,
+    max_new_tokens=100,
+    temperature=0.7,
+    top_p=0.9,
+    do_sample=True,
+    device="cpu",
+    stats=None,
+    window=None,
+    cache=None,
+    prefix_cache=None,
+    stopping=None,
+):
+    """Yield (index, continuation) in input order, generating length-sorted batches.
+
+    Prompts are sorted within windows of ``window`` prompts (default: all of them),
+    so callers can stream finished rows to disk after every window. When a
+    ``GenerationCache`` is given, cached prompts skip the model entirely; with a
+    ``PrefixKVCache`` the prompt prefix shared by a batch is prefilled only once.
+    An active ``StopConfig`` ends each row independently (stop strings, repeated
+    n-grams, sentence count) and records per-row reasons in ``stats``; cached rows
+    replay the reason and saved tokens stored with them, so reruns report the same.
+    """
+    import torch
+    from transformers import LogitsProcessorList, StoppingCriteriaList
+
+    prepare_tokenizer(tokenizer)
+    stats = stats if stats is not None else GenerationStats()
+    timer = PrefillTimer()
+    start = time.perf_counter()
+    window = window or len(prompts) or 1
+
+    params = {
+        "max_new_tokens": max_new_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "do_sample": do_sample,
+    }
+    stopping = stopping if stopping is not None and stopping.active else None
+    # With stopping, cache values are JSON records that carry the stop reason.
+    key_params = dict(params, stopping=stopping.key(), record=1) if stopping else params
+
+    for offset in range(0, len(prompts), window):
+        window_prompts = prompts[offset : offset + window]
+        done = {}
+        if cache is not None:
+            for index, prompt in enumerate(window_prompts):
+                cached = cache.get(cache.key(prompt, key_params))
+                if cached is None:
+                    continue
+                if stopping:
+                    record = json.loads(cached)
+                    cached = record["text"]
+                    stats.stop_reasons[record["stop_reason"]] += 1
+                    stats.row_stop_reasons[offset + index] = record["stop_reason"]
+                    stats.tokens_saved += record["tokens_saved"]
+                done[index] = cached
+        pending = [i for i in range(len(window_prompts)) if i not in done]
+        encoded = {i: tokenizer.encode(window_prompts[i]) for i in pending}
+        next_index = 0
+
+        for positions in length_buckets([len(encoded[i]) for i in pending], batch_size):
+            bucket = [pending[position] for position in positions]
+            rows = [encoded[i] for i in bucket]
+            extra = {}
+            batch_start = time.perf_counter()
+            prefix_length = prefix_cache.prefix_length(rows) if prefix_cache is not None else 0
+            if prefix_length:
+                extra["past_key_values"] = prefix_cache.past_for(
+                    rows[0][:prefix_length], len(rows), stats
+                )
+            input_ids, attention_mask = build_batch(rows, prefix_length, tokenizer.pad_token_id)
+            input_ids = input_ids.to(device)
+            attention_mask = attention_mask.to(device)
+            if stopping:
+                stopper = RowStopper(tokenizer, stopping, input_ids.shape[1], len(rows))
+                extra["stopping_criteria"] = StoppingCriteriaList([stopper])
+            timer.reset()
+            with torch.no_grad():
+                output = model.generate(
+                    input_ids,
+                    attention_mask=attention_mask,
+                    pad_token_id=tokenizer.pad_token_id,
+                    logits_processor=LogitsProcessorList([timer]),
+                    **params,
+                    **extra,
+                )
+            if output.is_cuda:
+                torch.cuda.synchronize(output.device)
+            batch_end = time.perf_counter()
+            prefill_end = timer.first_call or batch_end
+            if stats.first_token_at is None:
+                stats.first_token_at = prefill_end
+            stats.prefill_seconds += prefill_end - batch_start
+            stats.decode_seconds += batch_end - prefill_end
+
+            prompt_width = input_ids.shape[1]
+            if stopping and any(reason not in (None, "eos") for reason in stopper.reasons):
+                # Steps left when the last row stopped; all-EOS batches would end anyway.
+                stats.decode_steps_saved += max_new_tokens - (output.shape[1] - prompt_width)
+            for row, index in enumerate(bucket):
+                new_ids = output[row, prompt_width:].tolist()
+                generated = count_new_tokens(new_ids, tokenizer.eos_token_id)
+                reason = stopper.reasons[row] if stopping else None
+                saved = 0
+                if reason is not None:
+                    generated = stopper.generated[row]
+                    new_ids = new_ids[: stopper.keep[row]]
+                    if reason != "eos":
+                        saved = max_new_tokens - generated
+                        stats.tokens_saved += saved
+                full_text = tokenizer.decode(encoded[index] + new_ids, skip_special_tokens=True)
+                prompt_text = tokenizer.decode(encoded[index], skip_special_tokens=True)
+                done[index] = full_text[len(prompt_text) :]
+                if stopping:
+                    reason = reason or "length"
+                    if reason == "stop_string":
+                        done[index] = trim_stop_string(done[index], stopping.stop_strings)
+                    stats.stop_reasons[reason] += 1
+                    stats.row_stop_reasons[offset + index] = reason
+                if cache is not None:
+                    value = done[index]
+                    if stopping:
+                        value = json.dumps(
+                            {"text": value, "stop_reason": reason, "tokens_saved": saved},
+                            ensure_ascii=False,
+                        )
+                    cache.put(cache.key(window_prompts[index], key_params), value)
+                stats.new_tokens += generated
+                stats.prompt_tokens += len(encoded[index])
+
+            stats.prompts += len(bucket)
+            stats.batches += 1
+            stats.elapsed = time.perf_counter() - start
+
+            while next_index in done:
+                yield offset + next_index, done.pop(next_index)
+                next_index += 1
+
+        if cache is not None:
+            cache.commit()
+        while next_index in done:
+            yield offset + next_index, done.pop(next_index)
+            next_index += 1
+
+
+def generate_batched(model, tokenizer, prompts, **kwargs):
+    return [text for _, text in iter_generate(model, tokenizer, prompts, **kwargs)]
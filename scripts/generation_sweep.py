@@ -0,0 +1,207 @@
+import argparse
+import itertools
+import json
+import re
+import time
+from pathlib import Path
+
+from cpu_inference import add_inference_args, load_for_inference
+from generate_outputs import collect_prompts, load_model
+from generation_cache import add_cache_args, open_cache
+from generation_engine import GenerationStats, PrefixKVCache, iter_generate
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import JsonlAppendWriter, load_jsonl_parallel
+from model_loading import import_model_stack
+from stopping import StopConfig, add_stopping_args
+
+
+def parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def model_slug(model_id):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", model_id.strip("/")).strip("_")
+
+
+def cell_name(model_id, temperature, top_p):
+    return f"{model_slug(model_id)}__t{temperature:g}__p{top_p:g}"
+
+
+def run_cell(
+    model,
+    tokenizer,
+    prompts,
+    output_path,
+    args,
+    temperature,
+    top_p,
+    device,
+    cache,
+    prefix_cache,
+    stopping,
+):
+    from transformers import set_seed
+
+    set_seed(args.seed)
+    stats = GenerationStats()
+    start = time.perf_counter()
+    with JsonlAppendWriter(output_path) as writer:
+        for index, continuation in iter_generate(
+            model,
+            tokenizer,
+            prompts,
+            batch_size=args.batch_size,
+            max_new_tokens=args.max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            do_sample=True,
+            device=device,
+            stats=stats,
+            window=args.batch_size * 16,
+            cache=cache,
+            prefix_cache=prefix_cache,
+            stopping=stopping,
+        ):
+            record = {"prompt": prompts[index], "response": prompts[index] + continuation}
+            if stopping:
+                record["stop_reason"] = stats.row_stop_reasons.pop(index)
+            writer.write(record)
+    wall = time.perf_counter() - start
+    summary = stats.summary()
+    return {
+        "rows": writer.count,
+        "wall_seconds": round(wall, 3),
+        "new_tokens": summary["new_tokens"],
+        "tokens_per_sec": round(summary["new_tokens"] / wall, 2) if wall else 0.0,
+        "prefill_tokens_saved": summary["prefill_tokens_saved"],
+        "prefill_seconds": summary["prefill_seconds"],
+        "decode_seconds": summary["decode_seconds"],
+        **({"stop_reasons": summary["stop_reasons"]} if stopping else {}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate outputs for a grid of models x decoding configs."
+    )
+    parser.add_argument("--input", required=True, help="Path to test.jsonl (raw).")
+    parser.add_argument("--output_dir", default="outputs/sweep", help="Folder for cell outputs.")
+    parser.add_argument(
+        "--models",
+        default="distilgpt2",
+        help="Comma-separated HF model ids or local checkpoints.",
+    )
+    parser.add_argument("--temperatures", default="0.8", help="Comma-separated temperatures.")
+    parser.add_argument("--top_ps", default="0.95", help="Comma-separated top_p values.")
+    parser.add_argument("--prompt_field", default="prompt")
+    parser.add_argument("--fallback_field", default="response")
+    parser.add_argument("--max_rows", type=int, default=200)
+    parser.add_argument("--max_new_tokens", type=int, default=120)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--prefix_cache",
+        action="store_true",
+        help="Prefill the prompt prefix shared by each batch once and reuse its KV cache.",
+    )
+    parser.add_argument(
+        "--min_prefix_tokens",
+        type=int,
+        default=4,
+        help="Shortest shared prefix worth caching.",
+    )
+    add_cache_args(parser)
+    add_inference_args(parser)
+    add_stopping_args(parser)
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    run = RunProfile("generation_sweep", args.output_dir, args.profile, args.profile_json)
+    with run.stage("import"):
+        torch, _ = import_model_stack()
+    with run.stage("load_input") as stage:
+        fields = [name for name in (args.prompt_field, args.fallback_field) if name]
+        records = list(load_jsonl_parallel(Path(args.input), fields=fields))
+        stage["rows"] = len(records)
+    if args.max_rows > 0:
+        records = records[: args.max_rows]
+    prompts = collect_prompts(records, args.prompt_field, args.fallback_field)
+    if not prompts:
+        raise SystemExit("Input file has no usable prompts.")
+
+    models = parse_list(args.models)
+    grid = list(itertools.product(parse_list(args.temperatures, float), parse_list(args.top_ps, float)))
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    stopping = StopConfig.from_args(args)
+    cells = []
+    for model_id in models:
+        with run.stage(f"load_model:{model_id}") as stage:
+            tokenizer, model = load_for_inference(load_model, model_id, device, args)
+        load_seconds = stage["wall_seconds"]
+        print(f"Loaded {model_id} in {load_seconds}s")
+        cache = open_cache(args, model_id, model, args.seed)
+        prefix_cache = (
+            PrefixKVCache(model, device, args.min_prefix_tokens) if args.prefix_cache else None
+        )
+
+        for temperature, top_p in grid:
+            output_path = output_dir / f"{cell_name(model_id, temperature, top_p)}.jsonl"
+            with run.stage(output_path.stem, rows=len(prompts)):
+                result = run_cell(
+                    model,
+                    tokenizer,
+                    prompts,
+                    output_path,
+                    args,
+                    temperature,
+                    top_p,
+                    device,
+                    cache,
+                    prefix_cache,
+                    stopping,
+                )
+            cells.append(
+                {
+                    "model_id": model_id,
+                    "temperature": temperature,
+                    "top_p": top_p,
+                    "output": str(output_path),
+                    "model_load_seconds": load_seconds,
+                    **result,
+                }
+            )
+            print(
+                f"{output_path.name}: {result['rows']} rows in {result['wall_seconds']}s "
+                f"({result['tokens_per_sec']} tokens/sec)"
+            )
+
+        if cache is not None:
+            cache.report()
+            cache.close()
+        del model
+
+    manifest = {
+        "input": args.input,
+        "prompts": len(prompts),
+        "max_new_tokens": args.max_new_tokens,
+        "batch_size": args.batch_size,
+        "seed": args.seed,
+        "quantize": args.quantize,
+        "compile": args.compile,
+        "stopping": stopping.key() if stopping else None,
+        "models": models,
+        "temperatures": parse_list(args.temperatures, float),
+        "top_ps": parse_list(args.top_ps, float),
+        "cells": cells,
+    }
+    manifest_path = output_dir / "manifest.json"
+    manifest_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    print(f"Wrote {len(cells)} cells and manifest to {manifest_path}")
+    run.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+from generation_cache import open_cache
+from generation_engine import GenerationStats, PrefixKVCache, iter_generate
+
+# How often a waiting parent checks that every worker is still alive.
+POLL_SECONDS = 1.0
+STAT_FIELDS = (
+    "prompts",
+    "batches",
+    "prompt_tokens",
+    "new_tokens",
+    "prefill_tokens_saved",
+    "tokens_saved",
+    "decode_steps_saved",
+)
+
+
+def threads_per_worker(workers, threads=None):
+    """Intra-op threads per worker: an explicit value, or the cores split evenly."""
+    return threads or max(1, (os.cpu_count() or 1) // workers)
+
+
+def _run_worker(
+    rank,
+    loader,
+    model_id,
+    device,
+    prompts,
+    threads,
+    cache_args,
+    prefix_options,
+    generate_kwargs,
+    results,
+):
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # already fixed by an earlier parallel op
+
+        load_start = time.perf_counter()
+        tokenizer, model = loader(model_id, device)
+        load_seconds = time.perf_counter() - load_start
+        cache = open_cache(cache_args, model_id, model, seed=None) if cache_args else None
+        prefix_cache = PrefixKVCache(model, device, **prefix_options) if prefix_options else None
+
+        stats = GenerationStats()
+        started_at = time.time()
+        generations = iter_generate(
+            model,
+            tokenizer,
+            prompts,
+            device=device,
+            stats=stats,
+            cache=cache,
+            prefix_cache=prefix_cache,
+            **generate_kwargs,
+        )
+        for index, text in generations:
+            results.put((rank, index, (text, stats.row_stop_reasons.pop(index, None))))
+        summary = {
+            "rank": rank,
+            "threads": threads,
+            "load_seconds": round(load_seconds, 3),
+            # Wall-clock stamps, comparable across processes, bound the generation span.
+            "started_at": started_at,
+            "finished_at": time.time(),
+        }
+        summary.update(stats.summary())
+        if cache is not None:
+            summary.update(cache_hits=cache.hits, cache_misses=cache.misses)
+            cache.close()
+        results.put((rank, None, summary))
+    except BaseException:
+        results.put((rank, None, {"rank": rank, "error": traceback.format_exc()}))
+
+
+class ShardedGeneration:
+    """Generate with `workers` processes, each holding its own copy of the model.
+
+    Prompts are dealt round-robin, so every worker gets a similar length mix, and
+    iterating yields (index, continuation) in input order like ``iter_generate``;
+    per-row stop reasons land in ``stats.row_stop_reasons`` under the same index.
+    Workers are spawned (not forked) so each starts a clean torch runtime with
+    ``threads`` intra-op threads. After iteration, ``stats`` aggregates all workers
+    and ``summary()`` reports per-worker and aggregate throughput.
+    """
+
+    def __init__(
+        self,
+        loader,
+        model_id,
+        prompts,
+        workers,
+        threads=None,
+        device="cpu",
+        cache_args=None,
+        prefix_options=None,
+        **generate_kwargs,
+    ):
+        self.loader = loader
+        self.model_id = model_id
+        self.prompts = prompts
+        self.workers = max(1, min(workers, len(prompts) or 1))
+        self.threads = threads_per_worker(self.workers, threads)
+        self.device = device
+        self.cache_args = cache_args
+        self.prefix_options = prefix_options
+        self.generate_kwargs = generate_kwargs
+        self.stats = GenerationStats()
+        self.workers_summary = []
+        self.wall_seconds = 0.0
+
+    def __len__(self):
+        return len(self.prompts)
+
+    def __iter__(self):
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=_run_worker,
+                args=(
+                    rank,
+                    self.loader,
+                    self.model_id,
+                    self.device,
+                    self.prompts[rank :: self.workers],
+                    self.threads,
+                    self.cache_args,
+                    self.prefix_options,
+                    self.generate_kwargs,
+                    results,
+                ),
+                daemon=True,
+            )
+            for rank in range(self.workers)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+
+        buffered = [{} for _ in processes]
+        summaries = {}
+        try:
+            for index in range(len(self.prompts)):
+                rank, local = index % self.workers, index // self.workers
+                while local not in buffered[rank]:
+                    self._receive(results, buffered, summaries, processes)
+                text, reason = buffered[rank].pop(local)
+                if reason is not None:
+                    self.stats.row_stop_reasons[index] = reason
+                yield index, text
+            while len(summaries) < self.workers:
+                self._receive(results, buffered, summaries, processes)
+        finally:
+            for process in processes:
+                if process.is_alive() and len(summaries) < self.workers:
+                    process.terminate()
+                process.join()
+
+        self.wall_seconds = time.perf_counter() - start
+        self.workers_summary = [summaries[rank] for rank in range(self.workers)]
+        for summary in self.workers_summary:
+            for field in STAT_FIELDS:
+                setattr(self.stats, field, getattr(self.stats, field) + summary[field])
+            self.stats.prefill_seconds += summary["prefill_seconds"]
+            self.stats.decode_seconds += summary["decode_seconds"]
+            self.stats.stop_reasons.update(summary["stop_reasons"])
+        # Throughput excludes model loading: from the first worker starting to the last finishing.
+        self.stats.elapsed = max(w["finished_at"] for w in self.workers_summary) - min(
+            w["started_at"] for w in self.workers_summary
+        )
+
+    def _receive(self, results, buffered, summaries, processes):
+        """Take one message; raise if a worker died (OOM kill, signal) without reporting."""
+        while True:
+            try:
+                rank, index, payload = results.get(timeout=POLL_SECONDS)
+                break
+            except queue.Empty:
+                for rank, process in enumerate(processes):
+                    if process.exitcode is not None and rank not in summaries:
+                        raise RuntimeError(
+                            f"Generation worker {rank} exited with code {process.exitcode} "
+                            "without reporting a result"
+                        )
+        if index is not None:
+            buffered[rank][index] = payload
+        elif "error" in payload:
+            raise RuntimeError(f"Generation worker {rank} failed:\n{payload['error']}")
+        else:
+            summaries[rank] = payload
+
+    def summary(self):
+        """Per-worker rates, aggregate rate and how much the workers overlapped.
+
+        ``overlap_factor`` is the aggregate rate over the mean per-worker rate: how
+        many workers were generating at once on average (at most ``workers``). It
+        says nothing about contention; compare ``tokens_per_sec`` with a
+        ``--workers 1`` run for the real speedup.
+        """
+        rates = [worker["tokens_per_sec"] for worker in self.workers_summary]
+        mean_rate = sum(rates) / len(rates) if rates else 0.0
+        generation_seconds = max(self.stats.elapsed, 1e-9)
+        aggregate = self.stats.new_tokens / generation_seconds
+        return {
+            "workers": self.workers,
+            "threads_per_worker": self.threads,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "generation_seconds": round(self.stats.elapsed, 3),
+            "tokens_per_sec": round(aggregate, 2),
+            "prompts_per_sec": round(self.stats.prompts / generation_seconds, 2),
+            "overlap_factor": round(aggregate / mean_rate, 2) if mean_rate else 0.0,
+            "per_worker": self.workers_summary,
+        }
+
+    def report(self):
+        data = self.summary()
+        for worker in data["per_worker"]:
+            print(
+                f"  worker {worker['rank']}: {worker['prompts']} prompts, "
+                f"{worker['tokens_per_sec']} tokens/sec on {worker['threads']} threads "
+                f"(model load {worker['load_seconds']}s)"
+            )
+        print(
+            f"{data['workers']} workers x {data['threads_per_worker']} threads: "
+            f"{data['tokens_per_sec']} tokens/sec overall "
+            f"({data['overlap_factor']} of {data['workers']} workers busy on average)"
+        )
+        hits = sum(worker.get("cache_hits", 0) for worker in data["per_worker"])
+        misses = sum(worker.get("cache_misses", 0) for worker in data["per_worker"])
+        if hits or misses:
+            print(f"Cache: {hits} hits, {misses} misses ({hits / (hits + misses):.1%} hit rate)")
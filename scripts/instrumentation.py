@@ -0,0 +1,132 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Set on first import, before any script imports torch: close to interpreter start.
+PROCESS_START = time.perf_counter()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process or its largest finished child, in MB."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is bytes on macOS and kilobytes on Linux.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def cpu_seconds():
+    # Includes finished worker processes (datasets num_proc, process pools).
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def sidecar_path(output, suffix):
+    """`<output><suffix>` next to an output file, or `run<suffix>` inside an output folder."""
+    output = Path(output)
+    if output.is_dir() or not output.suffix:
+        return output / f"run{suffix}"
+    return output.with_name(output.name + suffix)
+
+
+def add_profile_args(parser):
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run under cProfile and dump <output>.prof (e.g. snakeviz, flameprof); "
+        "also writes <output>.profile.json.",
+    )
+    parser.add_argument(
+        "--profile_json",
+        action="store_true",
+        help="Write the per-stage timings to <output>.profile.json.",
+    )
+
+
+class RunProfile:
+    """Per-stage wall/CPU time, rows/sec and peak RSS for one script run.
+
+    Use ``stage()`` around each phase; on exit the stages are printed, and with
+    ``profile_json=True`` written as JSON to ``<output>.profile.json``. With
+    ``profile=True`` the whole run is also recorded with cProfile and dumped to
+    ``<output>.prof``, next to the JSON. Without an output path both files are
+    named after the script in the working directory.
+    """
+
+    def __init__(self, script, output=None, profile=False, profile_json=False):
+        self.script = script
+        self.output = output
+        self.write_json = profile or profile_json
+        self.stages = []
+        self.extra = {}
+        self._wall = time.perf_counter()
+        self._cpu = cpu_seconds()
+        self._profiler = cProfile.Profile() if profile else None
+        if self._profiler is not None:
+            self._profiler.enable()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Time one stage; set ``record["rows"]`` inside the block if not known up front."""
+        record = {"name": name, "rows": rows}
+        wall = time.perf_counter()
+        cpu = cpu_seconds()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = round(time.perf_counter() - wall, 4)
+            record["cpu_seconds"] = round(cpu_seconds() - cpu, 4)
+            if record["rows"] is not None and record["wall_seconds"] > 0:
+                record["rows_per_sec"] = round(record["rows"] / record["wall_seconds"], 2)
+            record["peak_rss_mb"] = round(peak_rss_mb(), 1)
+            self.stages.append(record)
+
+    def set(self, **fields):
+        """Attach extra run-level metrics (e.g. generation prefill/decode split)."""
+        self.extra.update(fields)
+
+    def summary(self):
+        return {
+            "script": self.script,
+            "argv": sys.argv[1:],
+            "wall_seconds": round(time.perf_counter() - self._wall, 4),
+            "cpu_seconds": round(cpu_seconds() - self._cpu, 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": self.stages,
+            **self.extra,
+        }
+
+    def report(self):
+        for record in self.stages:
+            rate = f", {record['rows_per_sec']} rows/sec" if "rows_per_sec" in record else ""
+            print(
+                f"[{record['name']}] {record['wall_seconds']}s wall, "
+                f"{record['cpu_seconds']}s cpu{rate}, peak RSS {record['peak_rss_mb']} MB"
+            )
+
+    def _sidecar(self, suffix):
+        if self.output is None:
+            return Path(f"{self.script}{suffix}")
+        return sidecar_path(self.output, suffix)
+
+    def finish(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+        data = self.summary()
+        self.report()
+        if self.write_json:
+            path = self._sidecar(".profile.json")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+            print(f"Wrote profile to {path}")
+        if self._profiler is not None:
+            prof_path = self._sidecar(".prof")
+            self._profiler.dump_stats(str(prof_path))
+            print(f"Wrote cProfile data to {prof_path}")
+        return data
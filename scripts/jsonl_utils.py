@@ -1,18 +1,440 @@
-import json
-from pathlib import Path
-
-
-def load_jsonl(path: Path):
-    with path.open("r", encoding="utf-8") as handle:
-        for line in handle:
-            line = line.strip()
-            if not line:
-                continue
-            yield json.loads(line)
-
-
-def write_jsonl(path: Path, records):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as handle:
-        for record in records:
-            handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+import hashlib
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    try:
+        import msgspec
+
+        _loads = msgspec.json.decode
+        JSON_BACKEND = "msgspec"
+    except ImportError:
+        _loads = json.loads
+        JSON_BACKEND = "json"
+
+try:
+    import msgspec as _msgspec
+except ImportError:
+    _msgspec = None
+
+PARALLEL_MIN_BYTES = 64 * 1024 * 1024
+SPLIT_FORMATS = {"jsonl": ".jsonl", "parquet": ".parquet", "arrow": ".arrow"}
+COLUMNAR_SUFFIXES = (".parquet", ".arrow")
+COLUMNAR_BATCH_ROWS = 10_000
+EMPTY_STRUCTS_KEY = b"questcrafter.empty_structs"
+
+
+def make_decoder(fields=None):
+    """Return a bytes -> dict decoder, keeping only `fields` when given.
+
+    With msgspec installed, projected decoding skips unrequested keys without
+    building Python objects for them; otherwise rows are parsed and then trimmed.
+    """
+    if not fields:
+        return _loads
+    fields = tuple(fields)
+    if _msgspec is not None:
+        projection = _msgspec.defstruct(
+            "Projection", [(name, object, _msgspec.UNSET) for name in fields]
+        )
+        decoder = _msgspec.json.Decoder(projection)
+
+        def decode(line):
+            row = decoder.decode(line)
+            return {
+                name: getattr(row, name)
+                for name in fields
+                if getattr(row, name) is not _msgspec.UNSET
+            }
+
+        return decode
+
+    def decode(line):
+        record = _loads(line)
+        return {name: record[name] for name in fields if name in record}
+
+    return decode
+
+
+def is_columnar(path: Path) -> bool:
+    return Path(path).suffix in COLUMNAR_SUFFIXES
+
+
+def find_split(root: Path, name: str) -> Path:
+    """Return `root/name.<ext>` for the first split format present (JSONL if none is)."""
+    for suffix in SPLIT_FORMATS.values():
+        candidate = root / f"{name}{suffix}"
+        if candidate.exists():
+            return candidate
+    return root / f"{name}.jsonl"
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as exc:
+        raise SystemExit(
+            "Missing dependency: pyarrow (needed for .parquet/.arrow files). Install with:\n"
+            "pip install pyarrow"
+        ) from exc
+    return pyarrow
+
+
+def _drop_nulls(record):
+    # Columnar files store absent keys as nulls; dropping them restores the JSONL rows.
+    return {
+        key: _drop_nulls(value) if isinstance(value, dict) else value
+        for key, value in record.items()
+        if value is not None
+    }
+
+
+def _empty_structs(schema):
+    return json.loads((schema.metadata or {}).get(EMPTY_STRUCTS_KEY, b"[]"))
+
+
+def empty_struct_columns(path: Path):
+    """Columns a Parquet split stores as nulls because every row held an empty dict."""
+    if path.suffix != ".parquet":
+        return []
+    import pyarrow.parquet as pq
+
+    return _empty_structs(pq.read_schema(str(path)))
+
+
+def restore_record(record, empty=()):
+    """Undo the columnar encoding of one row: drop null keys, re-create empty dicts."""
+    for name in empty:
+        if name in record and record[name] is None:
+            record[name] = {}
+    return _drop_nulls(record)
+
+
+def _columnar_batches(path: Path, fields=None):
+    pa = _require_pyarrow()
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(str(path), memory_map=True)
+        schema = parquet.schema_arrow
+        columns = [name for name in fields if name in schema.names] if fields else None
+        for batch in parquet.iter_batches(batch_size=COLUMNAR_BATCH_ROWS, columns=columns):
+            yield batch, _empty_structs(schema)
+        return
+    with pa.memory_map(str(path), "r") as source:
+        reader = pa.ipc.open_file(source)
+        columns = [name for name in fields if name in reader.schema.names] if fields else None
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            yield (batch.select(columns) if columns is not None else batch), []
+
+
+def load_columnar(path: Path, fields=None):
+    """Yield rows of a Parquet/Arrow split, reading only `fields` (memory-mapped).
+
+    Rows come back exactly as they were written from JSONL: keys absent from a
+    row (stored as nulls) are dropped again, including inside `metadata`.
+    """
+    for batch, empty in _columnar_batches(Path(path), fields):
+        for record in batch.to_pylist():
+            yield restore_record(record, empty)
+
+
+def open_columnar_table(path: Path, fields=None):
+    """Memory-map a Parquet/Arrow split as a pyarrow Table holding only `fields`."""
+    pa = _require_pyarrow()
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        names = pq.read_schema(str(path)).names
+        columns = [name for name in fields if name in names] if fields else None
+        return pq.read_table(str(path), columns=columns, memory_map=True)
+    table = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+    return table.select([name for name in fields if name in table.column_names]) if fields else table
+
+
+def columnar_record(table, index: int):
+    """Row `index` of a table from open_columnar_table, as load_columnar would yield it."""
+    return restore_record(table.slice(index, 1).to_pylist()[0], _empty_structs(table.schema))
+
+
+def load_jsonl(path: Path, fields=None, start=0):
+    """Stream rows of a split; .parquet/.arrow files are read column-projected.
+
+    `start` is a byte offset on a line boundary (JSONL only), e.g. where rows
+    appended since a previous run begin.
+    """
+    if is_columnar(path):
+        yield from load_columnar(path, fields)
+        return
+    decode = make_decoder(fields)
+    with path.open("rb") as handle:
+        handle.seek(start)
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            yield decode(line)
+
+
+def line_aligned_ranges(path: Path, parts: int):
+    """Split a file into up to `parts` byte ranges that start and end on line boundaries."""
+    size = path.stat().st_size
+    if size == 0:
+        return []
+    step = max(1, size // max(1, parts))
+    bounds = [0]
+    with path.open("rb") as handle:
+        while bounds[-1] + step < size:
+            handle.seek(bounds[-1] + step)
+            handle.readline()
+            position = handle.tell()
+            if position >= size:
+                break
+            bounds.append(position)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _parse_range(task):
+    path, start, end, fields = task
+    decode = make_decoder(fields)
+    with open(path, "rb") as handle:
+        handle.seek(start)
+        data = handle.read(end - start)
+    return [decode(line) for line in data.splitlines() if line.strip()]
+
+
+def load_jsonl_parallel(path: Path, fields=None, workers=None):
+    """Parse a JSONL file in line-aligned byte ranges across a process pool.
+
+    Rows are yielded in file order. Files below PARALLEL_MIN_BYTES, or a single
+    worker, fall back to the streaming `load_jsonl`.
+    """
+    workers = workers or os.cpu_count() or 1
+    if is_columnar(path) or workers <= 1 or path.stat().st_size < PARALLEL_MIN_BYTES:
+        yield from load_jsonl(path, fields)
+        return
+    tasks = [
+        (str(path), start, end, tuple(fields) if fields else None)
+        for start, end in line_aligned_ranges(path, workers * 4)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for rows in pool.map(_parse_range, tasks):
+            yield from rows
+
+
+def write_jsonl(path: Path, records):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as handle:
+        for record in records:
+            handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _merge_key_order(order, keys):
+    # Insert unseen keys after the key that precedes them in this row, so rows whose
+    # keys are subsequences of one order (like metadata) keep that order.
+    position = 0
+    for key in keys:
+        if key in order:
+            position = order.index(key) + 1
+        else:
+            order.insert(position, key)
+            position += 1
+
+
+def columnar_schema(records):
+    """Infer one Arrow schema for all records, keeping JSONL key order."""
+    pa = _require_pyarrow()
+    schema = None
+    orders = {None: []}
+    chunk = []
+
+    def absorb(rows):
+        nonlocal schema
+        for row in rows:
+            _merge_key_order(orders[None], row)
+            for key, value in row.items():
+                if isinstance(value, dict):
+                    _merge_key_order(orders.setdefault(key, []), value)
+        inferred = pa.Table.from_pylist(rows).schema
+        schema = inferred if schema is None else pa.unify_schemas(
+            [schema, inferred], promote_options="permissive"
+        )
+
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= COLUMNAR_BATCH_ROWS:
+            absorb(chunk)
+            chunk = []
+    if chunk or schema is None:
+        absorb(chunk)
+
+    fields = []
+    for name in orders[None]:
+        field = schema.field(name)
+        if pa.types.is_struct(field.type) and name in orders:
+            children = [field.type.field(key) for key in orders[name]]
+            field = field.with_type(pa.struct(children))
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def write_columnar(path: Path, records, schema=None):
+    """Write records to .parquet or .arrow (Arrow IPC file, memory-mappable).
+
+    `records` is iterated twice (schema inference, then writing) unless a schema
+    is given, so pass a list, a datasets.Dataset or another re-iterable.
+    """
+    pa = _require_pyarrow()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    schema = schema or columnar_schema(records)
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        # Parquet cannot store a struct without fields (e.g. an always-empty metadata).
+        empty = [f.name for f in schema if pa.types.is_struct(f.type) and f.type.num_fields == 0]
+        if empty:
+            schema = pa.schema(
+                [pa.field(f.name, pa.null()) if f.name in empty else f for f in schema],
+                metadata={EMPTY_STRUCTS_KEY: json.dumps(empty).encode("utf-8")},
+            )
+        writer = pq.ParquetWriter(str(path), schema)
+    elif path.suffix == ".arrow":
+        writer = pa.ipc.new_file(str(path), schema)
+    else:
+        raise ValueError(f"Not a columnar path: {path}")
+
+    count = 0
+    chunk = []
+    with writer:
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= COLUMNAR_BATCH_ROWS:
+                writer.write_table(_to_table(pa, chunk, schema))
+                count += len(chunk)
+                chunk = []
+        if chunk or count == 0:
+            writer.write_table(_to_table(pa, chunk, schema))
+            count += len(chunk)
+    return count
+
+
+def _to_table(pa, rows, schema):
+    names = [f.name for f in schema if pa.types.is_null(f.type)]
+    if names:
+        rows = [{k: v for k, v in row.items() if k not in names} for row in rows]
+    return pa.Table.from_pylist(rows, schema=schema)
+
+
+class _FileRows:
+    def __init__(self, path, fields=None):
+        self.path = path
+        self.fields = fields
+
+    def __iter__(self):
+        return load_jsonl(self.path, self.fields)
+
+
+def convert_split(source: Path, target: Path) -> int:
+    """Losslessly convert one split between .jsonl, .parquet and .arrow."""
+    rows = _FileRows(source)
+    if is_columnar(target):
+        return write_columnar(target, rows)
+    count = 0
+    with target.open("w", encoding="utf-8") as handle:
+        for record in rows:
+            handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+def drop_partial_line(path: Path) -> None:
+    """Truncate a trailing line left unfinished by a killed run."""
+    with path.open("rb+") as handle:
+        handle.seek(0, os.SEEK_END)
+        size = handle.tell()
+        if size == 0:
+            return
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            handle.seek(position - step)
+            chunk = handle.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position != size:
+            handle.truncate(position)
+
+
+def load_prompt_keys(path: Path, field: str = "prompt") -> Counter:
+    keys = Counter()
+    if not path.exists():
+        return keys
+    drop_partial_line(path)
+    for record in load_jsonl(path, fields=[field]):
+        value = record.get(field)
+        if isinstance(value, str):
+            keys[prompt_key(value)] += 1
+    return keys
+
+
+class JsonlAppendWriter:
+    """Incremental JSONL writer that flushes every row and fsyncs periodically."""
+
+    def __init__(self, path: Path, append: bool = False, fsync_every: int = 50):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.count = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if append and path.exists():
+            drop_partial_line(path)
+        self._handle = path.open("a" if append else "w", encoding="utf-8")
+
+    def write(self, record) -> None:
+        self._handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._handle.flush()
+        self.count += 1
+        if self.count % self.fsync_every == 0:
+            os.fsync(self._handle.fileno())
+
+    def close(self) -> None:
+        if self._handle.closed:
+            return
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def skip_completed(prompts, completed: Counter):
+    """Return indices of prompts without a row yet; duplicates are matched one-for-one."""
+    remaining = Counter(completed)
+    pending = []
+    for index, prompt in enumerate(prompts):
+        key = prompt_key(prompt)
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            continue
+        pending.append(index)
+    return pending
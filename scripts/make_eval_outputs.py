@@ -2,7 +2,8 @@ import argparse
 import random
 from pathlib import Path
 
-from jsonl_utils import load_jsonl, write_jsonl
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import load_jsonl_parallel, write_jsonl
 
 
 def main():
@@ -15,9 +16,13 @@ def main():
         "--max_rows", type=int, default=200, help="Max rows to export."
     )
     parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+    add_profile_args(parser)
     args = parser.parse_args()
 
-    records = list(load_jsonl(Path(args.input)))
+    run = RunProfile("make_eval_outputs", args.output_dir, args.profile, args.profile_json)
+    with run.stage("load_input") as stage:
+        records = list(load_jsonl_parallel(Path(args.input), fields=("prompt", "response")))
+        stage["rows"] = len(records)
     if not records:
         raise SystemExit("Input file is empty.")
 
@@ -36,9 +41,11 @@ def main():
         tuned.append({"prompt": prompt, "response": response})
 
     output_dir = Path(args.output_dir)
-    write_jsonl(output_dir / "baseline.jsonl", baseline)
-    write_jsonl(output_dir / "tuned.jsonl", tuned)
+    with run.stage("write", rows=len(baseline) + len(tuned)):
+        write_jsonl(output_dir / "baseline.jsonl", baseline)
+        write_jsonl(output_dir / "tuned.jsonl", tuned)
     print(f"Wrote {len(baseline)} rows to {output_dir}")
+    run.finish()
 
 
 if __name__ == "__main__":
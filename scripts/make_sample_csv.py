@@ -1,7 +1,22 @@
 import argparse
 import csv
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 
+from instrumentation import RunProfile, add_profile_args
+
+READ_BUFFER_BYTES = 16 * 1024 * 1024
+SAMPLE_MODES = ("head", "reservoir", "stratified")
+MAX_STRATA = 1000
+
+
+class TooManyStrata(ValueError):
+    pass
+
 
 def sniff_dialect(path: Path):
     with path.open("r", encoding="utf-8", errors="replace", newline="") as handle:
@@ -12,30 +27,164 @@ def sniff_dialect(path: Path):
         return csv.excel
 
 
-def sample_csv(path: Path, output_path: Path, max_rows: int) -> int:
+def _uniform(rng: random.Random) -> float:
+    # random() may return 0.0, which has no logarithm.
+    value = rng.random()
+    while value == 0.0:
+        value = rng.random()
+    return value
+
+
+def _skip(rng: random.Random, weight: float) -> int:
+    if weight >= 1.0:
+        return 0
+    return math.floor(math.log(_uniform(rng)) / math.log1p(-weight))
+
+
+def reservoir_sample(rows, k: int, rng: random.Random):
+    """Uniform sample of k rows in one pass and O(k) memory (Algorithm L).
+
+    The gap to the next replacement is drawn directly and consumed with islice,
+    so most rows cost no random draw. Rows are returned in file order.
+    """
+    rows = iter(rows)
+    reservoir = list(enumerate(islice(rows, k)))
+    if len(reservoir) < k or k <= 0:
+        return [row for _, row in reservoir]
+
+    index = k - 1
+    weight = math.exp(math.log(_uniform(rng)) / k)
+    while True:
+        skip = _skip(rng, weight)
+        row = next(islice(rows, skip, None), None)
+        if row is None:
+            break
+        index += skip + 1
+        reservoir[rng.randrange(k)] = (index, row)
+        weight *= math.exp(math.log(_uniform(rng)) / k)
+    return [row for _, row in sorted(reservoir, key=lambda item: item[0])]
+
+
+def allocate(counts, k: int):
+    """Split k rows across strata in proportion to their sizes (largest remainder).
+
+    Every stratum keeps at least one row when k allows it, so rare values of the
+    stratify column are not dropped from small samples.
+    """
+    total = sum(counts.values())
+    k = min(k, total)
+    if k <= 0:
+        return {}
+    quotas = {key: k * count / total for key, count in counts.items()}
+    take = {key: int(quota) for key, quota in quotas.items()}
+    if k >= len(counts):
+        take = {key: max(1, value) for key, value in take.items()}
+
+    remaining = k - sum(take.values())
+    by_remainder = sorted(counts, key=lambda key: quotas[key] - int(quotas[key]), reverse=True)
+    while remaining > 0:
+        for key in by_remainder:
+            if remaining and take[key] < counts[key]:
+                take[key] += 1
+                remaining -= 1
+    while remaining < 0:
+        shrinkable = [name for name in take if take[name] > 1]
+        key = max(shrinkable, key=lambda name: take[name] - quotas[name])
+        take[key] -= 1
+        remaining += 1
+    return {key: value for key, value in take.items() if value}
+
+
+def stratified_sample(rows, k: int, key_index: int, rng: random.Random, max_strata=MAX_STRATA):
+    """Proportional stratified sample of k rows keyed by one column, in one pass.
+
+    Each stratum keeps its own uniform reservoir (Algorithm R) of up to k rows,
+    so memory is O(k * strata); the final rows are drawn from those reservoirs
+    according to `allocate` and returned in file order. A column with more than
+    `max_strata` distinct values raises TooManyStrata, which bounds memory to
+    O(k * max_strata).
+    """
+    strata = {}
+    for index, row in enumerate(rows):
+        key = row[key_index] if key_index < len(row) else ""
+        stratum = strata.get(key)
+        if stratum is None:
+            if len(strata) >= max_strata:
+                raise TooManyStrata(f"more than {max_strata} distinct values")
+            stratum = strata[key] = [0, []]
+        stratum[0] += 1
+        if len(stratum[1]) < k:
+            stratum[1].append((index, row))
+        else:
+            slot = rng.randrange(stratum[0])
+            if slot < k:
+                stratum[1][slot] = (index, row)
+
+    chosen = []
+    for key, take in allocate({key: stratum[0] for key, stratum in strata.items()}, k).items():
+        chosen.extend(rng.sample(strata[key][1], take))
+    return [row for _, row in sorted(chosen, key=lambda item: item[0])]
+
+
+def sample_csv(
+    path: Path,
+    output_path: Path,
+    max_rows: int,
+    mode: str = "head",
+    stratify_column=None,
+    seed: int = 42,
+    max_strata: int = MAX_STRATA,
+) -> int:
+    # Sniffed once per file; the same dialect reads and writes it.
     dialect = sniff_dialect(path)
     if not getattr(dialect, "escapechar", None):
         dialect.escapechar = "\\"
     if not getattr(dialect, "doublequote", None):
         dialect.doublequote = True
-    with path.open("r", encoding="utf-8", errors="replace", newline="") as handle:
+    # Seeded per file so samples do not depend on which worker ran them.
+    rng = random.Random(f"{seed}:{path.name}")
+    with path.open(
+        "r", encoding="utf-8", errors="replace", newline="", buffering=READ_BUFFER_BYTES
+    ) as handle:
         reader = csv.reader(handle, dialect)
         try:
             header = next(reader)
         except StopIteration:
             return 0
 
+        if mode == "head":
+            rows = islice(reader, max_rows)
+        elif mode == "reservoir":
+            rows = reservoir_sample(reader, max_rows, rng)
+        elif mode == "stratified":
+            if stratify_column not in header:
+                raise ValueError(f"Stratify column not found in {path.name}: {stratify_column}")
+            try:
+                rows = stratified_sample(
+                    reader, max_rows, header.index(stratify_column), rng, max_strata
+                )
+            except TooManyStrata as exc:
+                # An id-like column would keep k rows per value; sample uniformly instead.
+                print(
+                    f"{path.name}: {stratify_column} has {exc}; "
+                    "falling back to a plain reservoir sample"
+                )
+                handle.seek(0)
+                reader = csv.reader(handle, dialect)
+                next(reader)
+                rows = reservoir_sample(reader, max_rows, rng)
+        else:
+            raise ValueError(f"Unknown sample mode: {mode}")
+
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        with output_path.open("w", encoding="utf-8", newline="") as out:
+        with output_path.open("w", encoding="utf-8", newline="", buffering=READ_BUFFER_BYTES) as out:
             writer = csv.writer(out, dialect)
             writer.writerow(header)
 
             count = 0
-            for row in reader:
+            for row in rows:
                 writer.writerow(row)
                 count += 1
-                if count >= max_rows:
-                    break
     return count
 
 
@@ -59,7 +208,37 @@ def main():
         default=1000,
         help="Maximum number of data rows per file (header not counted).",
     )
+    parser.add_argument(
+        "--mode",
+        choices=SAMPLE_MODES,
+        default="head",
+        help="head: first max_rows rows; reservoir: uniform over the whole file; "
+        "stratified: proportional per value of --stratify_column.",
+    )
+    parser.add_argument(
+        "--stratify_column",
+        default=None,
+        help="Column whose values define the strata for --mode stratified. Memory grows "
+        "with max_rows x distinct values, so use a low-cardinality column (not ids or text).",
+    )
+    parser.add_argument(
+        "--max_strata",
+        type=int,
+        default=MAX_STRATA,
+        help="Above this many distinct --stratify_column values a file falls back to "
+        "--mode reservoir (with a warning).",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for sampling.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Files sampled in parallel (default: one process per file, up to the CPU count).",
+    )
+    add_profile_args(parser)
     args = parser.parse_args()
+    if args.mode == "stratified" and not args.stratify_column:
+        parser.error("--mode stratified needs --stratify_column")
 
     input_dir = Path(args.input_dir)
     if not input_dir.exists():
@@ -72,10 +251,31 @@ def main():
     if not csv_files:
         raise SystemExit(f"No CSV files found in: {input_dir}")
 
-    for path in csv_files:
-        output_path = output_dir / path.name
-        written = sample_csv(path, output_path, args.max_rows)
-        print(f"{path.name}: {written} rows -> {output_path}")
+    run = RunProfile("make_sample_csv", output_dir, args.profile, args.profile_json)
+    workers = args.workers or min(len(csv_files), os.cpu_count() or 1)
+    with run.stage("sample") as stage:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    sample_csv,
+                    path,
+                    output_dir / path.name,
+                    args.max_rows,
+                    args.mode,
+                    args.stratify_column,
+                    args.seed,
+                    args.max_strata,
+                )
+                for path in csv_files
+            ]
+            try:
+                written = [future.result() for future in futures]
+            except ValueError as exc:
+                raise SystemExit(str(exc))
+        stage["rows"] = sum(written)
+    for path, count in zip(csv_files, written):
+        print(f"{path.name}: {count} rows -> {output_dir / path.name}")
+    run.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+import os
+import tempfile
+import zlib
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+SIGNATURE_BATCH_ROWS = 10_000
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
+def shingle_hashes(text, size):
+    """crc32 of every word `size`-gram of the lowercased text (one shingle if shorter)."""
+    words = text.lower().split()
+    if len(words) <= size:
+        grams = [" ".join(words)]
+    else:
+        grams = (" ".join(words[i : i + size]) for i in range(len(words) - size + 1))
+    return np.fromiter({zlib.crc32(gram.encode("utf-8")) for gram in grams}, dtype=np.uint64)
+
+
+def permutations(num_perm, seed):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(hashes, a, b):
+    # Universal hashing (a*x + b) mod p, truncated to 32 bits; uint64 overflow is intended.
+    with np.errstate(over="ignore"):
+        values = ((hashes[:, None] * a + b) % MERSENNE_PRIME) & MAX_HASH
+    return values.min(axis=0).astype(np.uint32)
+
+
+def signature_batch(texts, shingle_size, a, b):
+    return {"_minhash": [minhash(shingle_hashes(text or "", shingle_size), a, b) for text in texts]}
+
+
+def _false_rates(threshold, bands, rows):
+    xs = np.linspace(0.0, 1.0, 201)
+    candidate = 1 - (1 - xs ** rows) ** bands
+    fp = _trapezoid(np.where(xs < threshold, candidate, 0.0), xs)
+    fn = _trapezoid(np.where(xs >= threshold, 1 - candidate, 0.0), xs)
+    return fp, fn
+
+
+def optimal_bands(threshold, num_perm):
+    """(bands, rows) with bands * rows <= num_perm minimising false positives + negatives."""
+    best = None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            fp, fn = _false_rates(threshold, bands, rows)
+            if best is None or fp + fn < best[0]:
+                best = (fp + fn, bands, rows)
+    return best[1], best[2]
+
+
+def _find(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def near_duplicates(signatures, threshold, bands, rows):
+    """Boolean mask of rows to drop: every row whose cluster has an earlier row.
+
+    Rows sharing any LSH band are candidates; a candidate joins the band's first
+    row when their estimated Jaccard similarity reaches `threshold`.
+    """
+    count = signatures.shape[0]
+    parent = np.arange(count)
+    for band in range(bands):
+        block = signatures[:, band * rows : (band + 1) * rows].astype(np.uint64)
+        keys = np.zeros(count, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for column in block.T:
+                keys = keys * np.uint64(1_000_003) ^ column
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+        for group in np.split(order, bounds):
+            if group.size < 2:
+                continue
+            first = int(group[0])
+            similar = (signatures[group[1:]] == signatures[first]).mean(axis=1) >= threshold
+            for other in group[1:][similar]:
+                root_a, root_b = _find(parent, first), _find(parent, int(other))
+                if root_a != root_b:
+                    # The earliest row stays the root, so it is the one that is kept.
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+    roots = parent
+    while True:
+        hops = roots[roots]
+        if np.array_equal(hops, roots):
+            return roots != np.arange(count)
+        roots = hops
+
+
+def dedup_splits(
+    splits, text_column, threshold=0.8, shingle_size=5, num_perm=128, num_proc=None, seed=42
+):
+    """Drop near-duplicate rows across all splits; earlier splits win.
+
+    MinHash signatures are computed in num_proc workers and spilled to a memory-mapped
+    file, so memory stays bounded by one band of keys. Returns (splits, report) where
+    report holds rows/duplicates/rate for every split and for all of them.
+    """
+    a, b = permutations(num_perm, seed)
+    names = list(splits)
+    sizes = [splits[name].num_rows for name in names]
+    total = sum(sizes)
+    if total == 0:
+        return splits, {"all": {"rows": 0, "duplicates": 0, "rate": 0.0}}
+
+    handle, scratch = tempfile.mkstemp(suffix=".minhash.npy")
+    os.close(handle)
+    try:
+        signatures = np.lib.format.open_memmap(
+            scratch, mode="w+", dtype=np.uint32, shape=(total, num_perm)
+        )
+        offset = 0
+        for name in names:
+            hashed = splits[name].map(
+                signature_batch,
+                batched=True,
+                input_columns=text_column,
+                fn_kwargs={"shingle_size": shingle_size, "a": a, "b": b},
+                remove_columns=splits[name].column_names,
+                num_proc=num_proc,
+                desc=f"MinHash {name}",
+            ).with_format("numpy")
+            for batch in hashed.iter(batch_size=SIGNATURE_BATCH_ROWS):
+                block = np.asarray(batch["_minhash"], dtype=np.uint32).reshape(-1, num_perm)
+                signatures[offset : offset + len(block)] = block
+                offset += len(block)
+        signatures.flush()
+
+        bands, rows = optimal_bands(threshold, num_perm)
+        drop = near_duplicates(signatures, threshold, bands, rows)
+        del signatures
+    finally:
+        os.unlink(scratch)
+
+    kept = {}
+    report = {}
+    offset = 0
+    for name, size in zip(names, sizes):
+        mask = drop[offset : offset + size]
+        kept[name] = splits[name].select(np.flatnonzero(~mask))
+        duplicates = int(mask.sum())
+        report[name] = {
+            "rows": size,
+            "duplicates": duplicates,
+            "rate": round(duplicates / size, 4) if size else 0.0,
+        }
+        offset += size
+    duplicates = int(drop.sum())
+    report["all"] = {"rows": total, "duplicates": duplicates, "rate": round(duplicates / total, 4)}
+    return type(splits)(kept), report
@@ -0,0 +1,77 @@
+import time
+
+from instrumentation import PROCESS_START
+
+
+def import_model_stack():
+    """Import torch and transformers; entry points call this after parsing args.
+
+    Keeping these imports out of module scope lets ``--help``, argument errors and
+    data-only code paths skip the torch/transformers import (seconds on CPU boxes), and lets runs
+    time the import separately from loading the weights.
+    """
+    try:
+        import torch
+        import transformers
+        # transformers imports lazily; resolving the model classes is most of its cost.
+        from transformers import AutoModelForCausalLM, GPT2LMHeadModel  # noqa: F401
+    except ImportError as exc:
+        raise SystemExit(
+            "Missing dependency: transformers. Install with:\npip install transformers torch"
+        ) from exc
+    return torch, transformers
+
+
+def load_tokenizer(model_id):
+    """The Rust-backed (fast) tokenizer, converted from vocab/merges if the checkpoint has no tokenizer.json."""
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_id, use_fast=True)
+
+
+def load_weights(model_class, model_id, **kwargs):
+    """``from_pretrained`` from safetensors, which is memory-mapped instead of unpickled.
+
+    Checkpoints that only ship ``pytorch_model.bin`` fall back to the pickle loader.
+    """
+    try:
+        return model_class.from_pretrained(model_id, use_safetensors=True, **kwargs)
+    except OSError:
+        return model_class.from_pretrained(model_id, use_safetensors=False, **kwargs)
+
+
+def startup_summary(run, first_token_at=None, load_seconds=None):
+    """Import, model-load and time-to-first-token seconds from a run's stages.
+
+    Time to first token is measured from interpreter start (approximated by the
+    first import of ``instrumentation``) to the end of the first prefill. Runs
+    that load the model elsewhere (generation workers) pass ``load_seconds``.
+    Parts a run did not measure are None.
+    """
+    stages = {record["name"]: record["wall_seconds"] for record in run.stages}
+    if load_seconds is None:
+        load_seconds = stages.get("load_model")
+    summary = {
+        "import_seconds": stages.get("import"),
+        "load_model_seconds": load_seconds,
+        "time_to_first_token": (
+            round(first_token_at - PROCESS_START, 4) if first_token_at is not None else None
+        ),
+        "process_seconds": round(time.perf_counter() - PROCESS_START, 4),
+    }
+    run.set(startup=summary)
+    return summary
+
+
+def report_startup(run, first_token_at=None, load_seconds=None):
+    summary = startup_summary(run, first_token_at, load_seconds)
+    parts = []
+    if summary["import_seconds"] is not None:
+        parts.append(f"import {summary['import_seconds']}s")
+    if summary["load_model_seconds"] is not None:
+        parts.append(f"model load {summary['load_model_seconds']}s")
+    if summary["time_to_first_token"] is not None:
+        parts.append(f"first token {summary['time_to_first_token']}s after start")
+    if parts:
+        print(f"Startup: {', '.join(parts)}")
+    return summary
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+from instrumentation import sidecar_path
+
+HASH_CHUNK_BYTES = 1024 * 1024
+UNCHANGED, APPENDED, CHANGED = "unchanged", "appended", "changed"
+
+
+def file_digest(path: Path, previous=None, prefix=None):
+    """sha256, size and mtime of a file.
+
+    When size and mtime match `previous`, its hash is reused without reading the
+    file. With `prefix` (a byte count) the sha256 of the first `prefix` bytes is
+    computed in the same pass and returned as "prefix_sha256".
+    """
+    stat = path.stat()
+    digest = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and (previous["size"], previous["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+        digest["sha256"] = previous["sha256"]
+        return digest
+
+    sha = hashlib.sha256()
+    with path.open("rb") as handle:
+        if prefix is not None and prefix <= stat.st_size:
+            _hash_bytes(sha, handle, prefix)
+            # hexdigest() does not finalize, so hashing continues over the rest.
+            digest["prefix_sha256"] = sha.hexdigest()
+        _hash_bytes(sha, handle)
+    digest["sha256"] = sha.hexdigest()
+    return digest
+
+
+def _hash_bytes(sha, handle, limit=None):
+    while limit is None or limit > 0:
+        chunk = handle.read(HASH_CHUNK_BYTES if limit is None else min(HASH_CHUNK_BYTES, limit))
+        if not chunk:
+            return
+        sha.update(chunk)
+        if limit is not None:
+            limit -= len(chunk)
+
+
+def ends_line(path: Path, offset: int) -> bool:
+    """True when byte `offset - 1` is a newline, i.e. `offset` starts a new row."""
+    if offset <= 0:
+        return False
+    with path.open("rb") as handle:
+        handle.seek(offset - 1)
+        return handle.read(1) == b"\n"
+
+
+def write_tail(source: Path, offset: int, target: Path, keep_header=False) -> Path:
+    """Copy the rows appended after `offset` into `target` (plus the header line for CSV)."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with source.open("rb") as reader, target.open("wb") as writer:
+        if keep_header:
+            writer.write(reader.readline())
+        reader.seek(offset)
+        shutil.copyfileobj(reader, writer, HASH_CHUNK_BYTES)
+    return target
+
+
+def stage_args(args, exclude=("profile", "profile_json", "num_proc", "workers", "force")):
+    """The CLI arguments that affect a stage's output (run-time knobs excluded)."""
+    return {key: value for key, value in sorted(vars(args).items()) if key not in exclude}
+
+
+def add_manifest_args(parser):
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Ignore the stage manifest and reprocess every input from scratch.",
+    )
+
+
+class StageManifest:
+    """Content-addressed record of one pipeline stage: args, input and output hashes.
+
+    Stored next to the stage output as ``<output>.manifest.json`` (``run.manifest.json``
+    inside an output folder). A previous record only carries over when the script
+    and its arguments are unchanged, so ``check_input`` reports an input as
+    unchanged, appended (only new rows after the old end) or changed, and
+    ``output_intact`` confirms the old output was not touched since.
+    """
+
+    def __init__(self, script, output, args, force=False):
+        self.path = sidecar_path(output, ".manifest.json")
+        self.script = script
+        self.args = args
+        previous = {}
+        if not force and self.path.exists():
+            previous = json.loads(self.path.read_text(encoding="utf-8"))
+        if previous.get("script") != script or previous.get("args") != args:
+            previous = {}
+        self.previous = previous
+        self.inputs = {}
+        self.outputs = {}
+        # Stage-specific state (e.g. mergeable stats) carries over until overwritten.
+        self.state = dict(previous.get("state", {}))
+
+    def previous_state(self, name, default=None):
+        return self.previous.get("state", {}).get(name, default)
+
+    def check_input(self, name, path: Path):
+        """Return (status, offset); `offset` is where appended rows start."""
+        old = self.previous.get("inputs", {}).get(name)
+        digest = file_digest(path, old, prefix=old["size"] if old else None)
+        prefix_sha = digest.pop("prefix_sha256", None)
+        self.inputs[name] = {"path": str(path), **digest}
+        if old is None:
+            return CHANGED, 0
+        if digest["sha256"] == old["sha256"]:
+            return UNCHANGED, old["size"]
+        if prefix_sha == old["sha256"] and ends_line(path, old["size"]):
+            return APPENDED, old["size"]
+        return CHANGED, 0
+
+    def check_value(self, name, value):
+        """Like check_input for inputs identified by a fingerprint rather than a file."""
+        old = self.previous.get("inputs", {}).get(name)
+        self.inputs[name] = {"fingerprint": value}
+        return UNCHANGED if old == self.inputs[name] else CHANGED
+
+    def output_intact(self, name, path: Path) -> bool:
+        old = self.previous.get("outputs", {}).get(name)
+        if old is None or not path.exists():
+            return False
+        return file_digest(path, old)["sha256"] == old["sha256"]
+
+    def record_output(self, name, path: Path):
+        self.outputs[name] = {"path": str(path), **file_digest(path)}
+
+    def keep_output(self, name):
+        self.outputs[name] = self.previous["outputs"][name]
+
+    def save(self):
+        data = {
+            "script": self.script,
+            "args": self.args,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+        }
+        if self.state:
+            data["state"] = self.state
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        print(f"Wrote manifest to {self.path}")
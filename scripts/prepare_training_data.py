@@ -1,58 +1,112 @@
 import argparse
+import json
+import tempfile
 from pathlib import Path
 
 import datasets
 
-from jsonl_utils import write_jsonl
-
-def build_control_prefix(record, control_keys, control_format, drop_missing):
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import empty_struct_columns, find_split, is_columnar, restore_record
+from pipeline_manifest import (
+    APPENDED,
+    UNCHANGED,
+    StageManifest,
+    add_manifest_args,
+    stage_args,
+    write_tail,
+)
+
+WRITE_BATCH_ROWS = 10_000
+
+def control_prefixes(batch, size, control_keys, control_format, drop_missing):
+    """Control-token prefix for every row of a batch, plus whether the row is kept.
+
+    Top-level columns win over `metadata` keys; with drop_missing, rows missing
+    any key are flagged for dropping.
+    """
+    prefixes = [""] * size
+    keep = [True] * size
     if not control_keys:
-        return ""
+        return prefixes, keep
 
-    metadata = record.get("metadata") if isinstance(record.get("metadata"), dict) else {}
-    parts = []
+    metadata = batch.get("metadata") or [None] * size
     for key in control_keys:
-        value = record.get(key, None)
-        if value in (None, ""):
-            value = metadata.get(key, None)
-        if value in (None, ""):
-            if drop_missing:
-                return None
+        column = batch.get(key) or [None] * size
+        for i in range(size):
+            value = column[i]
+            if value in (None, ""):
+                meta = metadata[i] if isinstance(metadata[i], dict) else {}
+                value = meta.get(key, None)
+            if value in (None, ""):
+                if drop_missing:
+                    keep[i] = False
+                continue
+            prefixes[i] += control_format.format(key=key, value=str(value))
+    return prefixes, keep
+
+
+def prepare_batch(batch, args, restore=False, empty_structs=()):
+    """Serialized output row (input columns + `text`) and a `_keep` flag for every row."""
+    columns = list(batch)
+    size = len(batch[columns[0]]) if columns else 0
+    prefixes, keep = control_prefixes(
+        batch, size, args.control_keys, args.control_format, args.drop_missing_control
+    )
+    prompts = batch.get("prompt") or [""] * size
+    responses = batch.get("response") or [""] * size
+
+    lines = []
+    for i in range(size):
+        prompt, response = prompts[i], responses[i]
+        if not keep[i] or not isinstance(prompt, str) or not isinstance(response, str):
+            keep[i] = False
+            lines.append("")
             continue
-        parts.append(control_format.format(key=key, value=str(value)))
-    return "".join(parts)
-
-
-def to_training_record(record, args):
-    prompt = record.get("prompt", "")
-    response = record.get("response", "")
-    if not isinstance(prompt, str) or not isinstance(response, str):
-        return None
-
-    control_prefix = build_control_prefix(
-        record, args.control_keys, args.control_format, args.drop_missing_control
+        record = {name: batch[name][i] for name in columns}
+        if restore:
+            # Columnar splits store absent keys as nulls; write rows as they were.
+            record = restore_record(record, empty_structs)
+        record["text"] = (
+            f"{prefixes[i]}{args.prompt_prefix}{prompt}{args.separator}{args.response_prefix}{response}"
+        )
+        lines.append(json.dumps(record, ensure_ascii=False))
+    return {"_line": lines, "_keep": keep}
+
+
+def process_split(path: Path, output_path: Path, args, append=False):
+    """Convert one split in num_proc workers and stream the kept rows to output_path.
+
+    With `append` the rows are added to the end of an existing output. Returns
+    (written, dropped). Drops are counted from the `_keep` column after the
+    map, so the count is exact however the rows were spread across workers.
+    """
+    builder = {".parquet": "parquet", ".arrow": "arrow"}.get(path.suffix, "json")
+    dataset = datasets.load_dataset(builder, data_files=str(path), split="train")
+    mapped = dataset.map(
+        prepare_batch,
+        batched=True,
+        fn_kwargs={
+            "args": args,
+            "restore": is_columnar(path),
+            "empty_structs": empty_struct_columns(path),
+        },
+        remove_columns=dataset.column_names,
+        num_proc=args.num_proc,
+        desc=f"Preparing {path.name}",
     )
-    if control_prefix is None:
-        return None
-
-    text = f"{control_prefix}{args.prompt_prefix}{prompt}{args.separator}{args.response_prefix}{response}"
-
-    out = dict(record)
-    out["text"] = text
-    return out
 
-
-def process_split(path: Path, args):
-    dataset = datasets.load_dataset("json", data_files=str(path), split="train")
-    output = []
+    written = 0
     dropped = 0
-    for record in dataset:
-        out = to_training_record(record, args)
-        if out is None:
-            dropped += 1
-            continue
-        output.append(out)
-    return output, dropped
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open("a" if append else "w", encoding="utf-8") as handle:
+        for batch in mapped.iter(batch_size=WRITE_BATCH_ROWS):
+            for line, keep in zip(batch["_line"], batch["_keep"]):
+                if not keep:
+                    dropped += 1
+                    continue
+                handle.write(line + "\n")
+                written += 1
+    return written, dropped
 
 
 def main():
@@ -62,7 +116,7 @@ def main():
     parser.add_argument(
         "--input_dir",
         default="data/raw",
-        help="Folder containing dataset splits (train/val/test.jsonl).",
+        help="Folder containing dataset splits (train/val/test .jsonl, .parquet or .arrow).",
     )
     parser.add_argument(
         "--dataset",
@@ -104,22 +158,51 @@ def main():
         action="store_true",
         help="Drop rows missing any requested control key.",
     )
+    parser.add_argument(
+        "--num_proc",
+        type=int,
+        default=None,
+        help="Worker processes for the batched conversion.",
+    )
+    add_manifest_args(parser)
+    add_profile_args(parser)
     args = parser.parse_args()
 
     args.control_keys = [k.strip() for k in args.control_keys.split(",") if k.strip()]
 
     input_root = Path(args.input_dir) / args.dataset
     output_root = Path(args.output_dir) / args.dataset
+    run = RunProfile("prepare_training_data", output_root, args.profile, args.profile_json)
+    manifest = StageManifest("prepare_training_data", output_root, stage_args(args), args.force)
 
     for split_name, out_name in (("train", "train"), ("val", "validation"), ("test", "test")):
-        input_path = input_root / f"{split_name}.jsonl"
+        input_path = find_split(input_root, split_name)
         if not input_path.exists():
             raise SystemExit(f"Missing split: {input_path}")
 
-        records, dropped = process_split(input_path, args)
         output_path = output_root / f"{out_name}.jsonl"
-        write_jsonl(output_path, records)
-        print(f"{split_name}: {len(records)} rows (dropped {dropped}) -> {output_path}")
+        status, offset = manifest.check_input(split_name, input_path)
+        intact = manifest.output_intact(out_name, output_path)
+        if status == UNCHANGED and intact:
+            manifest.keep_output(out_name)
+            print(f"{split_name}: unchanged, kept {output_path}")
+            continue
+
+        with run.stage(split_name) as stage:
+            if status == APPENDED and intact:
+                # Rows map one-to-one onto output lines, so only the new tail is converted.
+                with tempfile.TemporaryDirectory() as scratch:
+                    delta = write_tail(input_path, offset, Path(scratch) / input_path.name)
+                    written, dropped = process_split(delta, output_path, args, append=True)
+                action = "appended"
+            else:
+                written, dropped = process_split(input_path, output_path, args)
+                action = "wrote"
+            stage["rows"] = written + dropped
+        manifest.record_output(out_name, output_path)
+        print(f"{split_name}: {action} {written} rows (dropped {dropped}) -> {output_path}")
+    manifest.save()
+    run.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+import hashlib
+from collections import defaultdict
+from pathlib import Path
+
+from jsonl_utils import columnar_record, is_columnar, load_jsonl, make_decoder, open_columnar_table
+
+
+def prompt_digest(prompt) -> bytes:
+    text = prompt if isinstance(prompt, str) else ""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class PromptIndex:
+    """Map prompt digests to the byte offsets of matching rows in a JSONL file.
+
+    Only 16-byte digests and integer offsets are kept in memory; rows are read
+    back from disk on lookup and their prompt is compared to rule out collisions.
+    For .parquet/.arrow files the offsets are row numbers in a memory-mapped table.
+    """
+
+    def __init__(self, path: Path, fields=("prompt", "response")):
+        self.path = path
+        self.offsets = defaultdict(list)
+        self._table = None
+        self._handle = None
+        if is_columnar(path):
+            self._table = open_columnar_table(path, fields)
+            for row, record in enumerate(load_jsonl(path, fields=("prompt",))):
+                self.offsets[prompt_digest(record.get("prompt", ""))].append(row)
+            return
+        self._decode = make_decoder(fields)
+        decode_prompt = make_decoder(("prompt",))
+        with path.open("rb") as handle:
+            offset = 0
+            for line in handle:
+                if line.strip():
+                    prompt = decode_prompt(line).get("prompt", "")
+                    self.offsets[prompt_digest(prompt)].append(offset)
+                offset += len(line)
+        self._handle = path.open("rb")
+
+    def _read(self, offset):
+        if self._table is not None:
+            return columnar_record(self._table, offset)
+        self._handle.seek(offset)
+        return self._decode(self._handle.readline())
+
+    def lookup(self, prompt):
+        """Return every indexed row whose prompt equals `prompt`, in file order."""
+        matches = []
+        for offset in self.offsets.get(prompt_digest(prompt), ()):
+            record = self._read(offset)
+            if record.get("prompt", "") == prompt:
+                matches.append(record)
+        return matches
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def join_by_prompt(left_path: Path, right_path: Path, fields=("prompt", "response")):
+    """Stream (left, right) pairs joined on `prompt`.
+
+    Each left row is paired with every right row sharing its prompt (one-to-many);
+    rows without a match are paired with None, like a left outer join.
+    """
+    with PromptIndex(right_path, fields) as index:
+        for left in load_jsonl(left_path, fields=fields):
+            matches = index.lookup(left.get("prompt", ""))
+            if not matches:
+                yield left, None
+                continue
+            for right in matches:
+                yield left, right
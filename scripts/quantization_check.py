@@ -0,0 +1,154 @@
+import argparse
+import json
+import time
+from argparse import Namespace
+from pathlib import Path
+
+from cpu_inference import load_for_inference, model_size_mb
+from generate_outputs import collect_prompts, load_model
+from generation_engine import GenerationStats, iter_generate
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import load_jsonl
+from model_loading import import_model_stack, report_startup
+
+
+def greedy_generate(model, tokenizer, prompts, batch_size, max_new_tokens):
+    """Greedy continuations plus timing; one untimed warm-up batch absorbs first-call costs."""
+    params = {
+        "batch_size": batch_size,
+        "max_new_tokens": max_new_tokens,
+        "temperature": None,
+        "top_p": None,
+        "do_sample": False,
+    }
+    list(iter_generate(model, tokenizer, prompts[:batch_size], **params))
+    stats = GenerationStats()
+    texts = [text for _, text in iter_generate(model, tokenizer, prompts, stats=stats, **params)]
+    return texts, stats
+
+
+def matching_prefix(a, b):
+    for position, (left, right) in enumerate(zip(a, b)):
+        if left != right:
+            return position
+    return min(len(a), len(b))
+
+
+def divergence(reference, candidate, tokenizer):
+    """How far greedy continuations drift from the reference, measured in tokens."""
+    exact = 0
+    agreement = 0.0
+    first_diff = []
+    for ref_text, text in zip(reference, candidate):
+        ref_ids, ids = tokenizer.encode(ref_text), tokenizer.encode(text)
+        common = matching_prefix(ref_ids, ids)
+        longest = max(len(ref_ids), len(ids))
+        if ref_ids == ids:
+            exact += 1
+        else:
+            first_diff.append(common)
+        agreement += common / longest if longest else 1.0
+    count = max(len(reference), 1)
+    return {
+        "exact_match": round(exact / count, 4),
+        "prefix_agreement": round(agreement / count, 4),
+        "mean_first_divergence_token": (
+            round(sum(first_diff) / len(first_diff), 2) if first_diff else None
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare int8 / compiled CPU inference with the fp32 model on fixed prompts."
+    )
+    parser.add_argument("--model_id", default="distilgpt2", help="HF model id or local path.")
+    parser.add_argument(
+        "--input", default="evaluation/test_prompts.jsonl", help="Fixed prompt set (JSONL)."
+    )
+    parser.add_argument("--prompt_field", default="prompt")
+    parser.add_argument("--fallback_field", default="response")
+    parser.add_argument("--max_rows", type=int, default=50, help="Prompts to decode.")
+    parser.add_argument("--max_new_tokens", type=int, default=40)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument(
+        "--compile", action="store_true", help="Also measure the torch.compile variants."
+    )
+    parser.add_argument("--quantized_dir", default=".cache/quantized")
+    parser.add_argument(
+        "--output", default="outputs/quantization_check.json", help="JSON report path."
+    )
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    run = RunProfile("quantization_check", args.output, args.profile, args.profile_json)
+    with run.stage("import"):
+        torch, _ = import_model_stack()
+    torch.manual_seed(0)
+
+    records = list(load_jsonl(Path(args.input)))[: args.max_rows]
+    prompts = collect_prompts(records, args.prompt_field, args.fallback_field)
+    if not prompts:
+        raise SystemExit(f"No prompts found in: {args.input}")
+
+    variants = [("fp32", "none", False), ("int8", "int8", False)]
+    if args.compile:
+        variants += [("fp32+compile", "none", True), ("int8+compile", "int8", True)]
+
+    results = {}
+    reference = None
+    for name, quantize, compiled in variants:
+        options = Namespace(quantize=quantize, compile=compiled, quantized_dir=args.quantized_dir)
+        with run.stage(f"{name}_load"):
+            start = time.perf_counter()
+            tokenizer, model = load_for_inference(load_model, args.model_id, "cpu", options)
+            load_seconds = time.perf_counter() - start
+        with run.stage(f"{name}_generate", rows=len(prompts)):
+            texts, stats = greedy_generate(
+                model, tokenizer, prompts, args.batch_size, args.max_new_tokens
+            )
+        result = {
+            "load_seconds": round(load_seconds, 3),
+            "size_mb": round(model_size_mb(model), 2),
+            "generate_seconds": round(stats.elapsed, 3),
+            "tokens_per_sec": stats.summary()["tokens_per_sec"],
+        }
+        if reference is None:
+            reference = (texts, result)
+        else:
+            base = reference[1]
+            result["speedup"] = round(base["generate_seconds"] / max(stats.elapsed, 1e-9), 2)
+            result["size_reduction"] = round(1 - result["size_mb"] / base["size_mb"], 4)
+            result.update(divergence(reference[0], texts, tokenizer))
+        results[name] = result
+
+    for name, result in results.items():
+        line = (
+            f"{name}: {result['size_mb']} MB, {result['generate_seconds']}s greedy decode "
+            f"({result['tokens_per_sec']} tokens/sec), load {result['load_seconds']}s"
+        )
+        if "speedup" in result:
+            line += (
+                f"\n  x{result['speedup']} vs fp32, {result['size_reduction']:.1%} smaller, "
+                f"exact match {result['exact_match']:.1%}, "
+                f"token prefix agreement {result['prefix_agreement']:.1%}"
+            )
+        print(line)
+
+    # The fp32 load is the one a plain generation run pays.
+    report_startup(run, load_seconds=results["fp32"]["load_seconds"])
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "model_id": args.model_id,
+        "prompts": len(prompts),
+        "max_new_tokens": args.max_new_tokens,
+        "variants": results,
+    }
+    output_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Wrote report to {output_path}")
+    run.finish()
+
+
+if __name__ == "__main__":
+    main()
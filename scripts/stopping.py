@@ -0,0 +1,118 @@
+SENTENCE_ENDS = (".", "!", "?")
+TRAILING_CLOSERS = "\"')]»”’"
+
+
+def add_stopping_args(parser):
+    parser.add_argument(
+        "--stop_strings",
+        nargs="*",
+        default=[],
+        help='End a row when it generates one of these strings, which are cut from the '
+        'output (e.g. "User:" to stop at the next turn of the training template).',
+    )
+    parser.add_argument(
+        "--repeat_ngram",
+        type=int,
+        default=0,
+        help="End a row when its last N generated tokens already occurred in it, keeping "
+        "the text before the repeat (0 disables; 6-8 catches repeated sentences).",
+    )
+    parser.add_argument(
+        "--max_sentences",
+        type=int,
+        default=0,
+        help="End a row after this many sentence-ending tokens (. ! ?); 0 disables.",
+    )
+
+
+class StopConfig:
+    """Per-row early-stopping rules; picklable so generation workers can share it."""
+
+    def __init__(self, stop_strings=(), repeat_ngram=0, max_sentences=0):
+        self.stop_strings = [text for text in stop_strings if text]
+        self.repeat_ngram = repeat_ngram
+        self.max_sentences = max_sentences
+
+    @classmethod
+    def from_args(cls, args):
+        config = cls(args.stop_strings, args.repeat_ngram, args.max_sentences)
+        return config if config.active else None
+
+    @property
+    def active(self):
+        return bool(self.stop_strings or self.repeat_ngram > 0 or self.max_sentences > 0)
+
+    def key(self):
+        """Part of generation cache keys: rows stopped differently are different outputs."""
+        return {
+            "stop_strings": self.stop_strings,
+            "repeat_ngram": self.repeat_ngram,
+            "max_sentences": self.max_sentences,
+        }
+
+
+def trim_stop_string(text, stop_strings):
+    """Cut text before the earliest stop string it contains."""
+    cut = min((text.find(stop) for stop in stop_strings if stop in text), default=-1)
+    return text[:cut] if cut >= 0 else text
+
+
+class RowStopper:
+    """Stopping criterion for batched generate that finishes each row on its own.
+
+    Returns one flag per row, so transformers pads finished rows while the others
+    keep decoding, and the batch ends once every row is done. For each stopped
+    row it records why (``reasons``) and how many generated tokens to keep
+    (``keep``); a repeated n-gram is dropped, the stop string is cut from the text.
+    """
+
+    def __init__(self, tokenizer, config, prompt_width, batch_size):
+        self.tokenizer = tokenizer
+        self.config = config
+        self.prompt_width = prompt_width
+        self.reasons = [None] * batch_size
+        self.keep = [None] * batch_size
+        self.generated = [None] * batch_size
+        self.sentences = [0] * batch_size
+        self.seen = [set() for _ in range(batch_size)]
+        # A stop string of L characters spans at most L tokens.
+        self.tail_tokens = max((len(stop) for stop in config.stop_strings), default=0)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        new_ids = input_ids[:, self.prompt_width :].tolist()
+        for row, ids in enumerate(new_ids):
+            if self.reasons[row] is None and ids:
+                self._check(row, ids)
+        done = [reason is not None for reason in self.reasons]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def _stop(self, row, reason, ids, keep=None):
+        self.reasons[row] = reason
+        self.generated[row] = len(ids)
+        self.keep[row] = len(ids) if keep is None else keep
+
+    def _check(self, row, ids):
+        config = self.config
+        if ids[-1] == self.tokenizer.eos_token_id:
+            self._stop(row, "eos", ids)
+            return
+        if self.tail_tokens:
+            tail = self.tokenizer.decode(ids[-self.tail_tokens :], skip_special_tokens=True)
+            if any(stop in tail for stop in config.stop_strings):
+                self._stop(row, "stop_string", ids)
+                return
+        size = config.repeat_ngram
+        if size > 0 and len(ids) >= size:
+            gram = tuple(ids[-size:])
+            if gram in self.seen[row]:
+                self._stop(row, "repetition", ids, keep=len(ids) - size)
+                return
+            self.seen[row].add(gram)
+        if config.max_sentences > 0:
+            piece = self.tokenizer.decode(ids[-1:], skip_special_tokens=True)
+            if piece.rstrip().rstrip(TRAILING_CLOSERS).endswith(SENTENCE_ENDS):
+                self.sentences[row] += 1
+                if self.sentences[row] >= config.max_sentences:
+                    self._stop(row, "sentence_end", ids)
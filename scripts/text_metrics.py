@@ -0,0 +1,53 @@
+import numpy as np
+
+
+def encode_tokens(token_lists):
+    """Map tokens to integer ids; return (ids, doc_index, vocab_size) as flat arrays."""
+    vocab = {}
+    ids = []
+    lengths = []
+    for tokens in token_lists:
+        ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+        lengths.append(len(tokens))
+    ids = np.asarray(ids, dtype=np.int64)
+    doc_index = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    return ids, doc_index, len(vocab)
+
+
+def count_ngrams(ids, doc_index, vocab_size, n, across_documents):
+    """Return (unique, total) n-gram counts over the flat id array."""
+    windows = len(ids) - n + 1
+    if n <= 0 or windows <= 0:
+        return 0, 0
+    starts = np.arange(windows)
+    if not across_documents:
+        starts = starts[doc_index[:windows] == doc_index[n - 1 :]]
+    if starts.size == 0:
+        return 0, 0
+
+    base = max(vocab_size, 1)
+    if base ** n < 2 ** 63:
+        # Exact polynomial code: each n-gram maps to a distinct int64.
+        codes = np.zeros(starts.size, dtype=np.int64)
+        for k in range(n):
+            codes = codes * base + ids[starts + k]
+        unique = np.unique(codes).size
+    else:
+        grams = np.stack([ids[starts + k] for k in range(n)], axis=1)
+        unique = np.unique(grams, axis=0).shape[0]
+    return int(unique), int(starts.size)
+
+
+def distinct_ns(token_lists, orders=(1, 2), across_documents=True):
+    """Distinct-n for every order in one pass over the tokenized corpus.
+
+    With across_documents=True the documents are treated as one concatenated
+    stream (n-grams may span a boundary); otherwise n-grams stay inside each
+    document. Ratios are unique / total n-grams, 0.0 when there are none.
+    """
+    ids, doc_index, vocab_size = encode_tokens(token_lists)
+    results = {}
+    for n in orders:
+        unique, total = count_ngrams(ids, doc_index, vocab_size, n, across_documents)
+        results[n] = unique / total if total else 0.0
+    return results
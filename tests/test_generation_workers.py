@@ -0,0 +1,97 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / "scripts"))
+from generation_workers import ShardedGeneration  # noqa: E402
+
+
+def _killed_loader(model_id, device):
+    # Like the OOM killer: the process vanishes without running any except block.
+    os._exit(137)
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory):
+    """A randomly initialised 1-layer GPT-2 with a small byte-level BPE tokenizer."""
+    pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+
+    path = tmp_path_factory.mktemp("tiny-gpt2")
+    bpe = tokenizers.Tokenizer(tokenizers.models.BPE())
+    bpe.pre_tokenizer = tokenizers.pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = tokenizers.decoders.ByteLevel()
+    trainer = tokenizers.trainers.BpeTrainer(
+        vocab_size=300,
+        special_tokens=["<|endoftext|>"],
+        initial_alphabet=tokenizers.pre_tokenizers.ByteLevel.alphabet(),
+    )
+    bpe.train_from_iterator(["Create a fantasy quest set in a forest. " * 20], trainer)
+    tokenizer = transformers.PreTrainedTokenizerFast(
+        tokenizer_object=bpe, eos_token="<|endoftext|>", bos_token="<|endoftext|>"
+    )
+    tokenizer.save_pretrained(path)
+
+    config = transformers.GPT2Config(
+        vocab_size=len(tokenizer), n_positions=64, n_embd=16, n_layer=1, n_head=2,
+        bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id,
+    )
+    transformers.GPT2LMHeadModel(config).save_pretrained(path)
+    return path
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_stop_reason_written_for_every_worker_count(tiny_model, tmp_path, workers):
+    prompts = tmp_path / "prompts.jsonl"
+    prompts.write_text(
+        "".join(json.dumps({"prompt": f"Create quest {i} in a forest"}) + "\n" for i in range(6)),
+        encoding="utf-8",
+    )
+    output = tmp_path / "out.jsonl"
+    subprocess.run(
+        [
+            sys.executable, str(REPO / "training" / "baseline_generation.py"),
+            "--model", str(tiny_model), "--input", str(prompts), "--output", str(output),
+            "--max_new_tokens", "12", "--batch_size", "2", "--workers", str(workers),
+            "--repeat_ngram", "2", "--no_cache",
+        ],
+        cwd=tmp_path, check=True, capture_output=True, text=True,
+    )
+    rows = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert [row["prompt"] for row in rows] == [f"Create quest {i} in a forest" for i in range(6)]
+    assert all(row.get("stop_reason") for row in rows)
+
+
+def test_cached_rows_keep_stop_reason(tiny_model, tmp_path):
+    prompts = tmp_path / "prompts.jsonl"
+    prompts.write_text(
+        "".join(json.dumps({"prompt": f"Create quest {i} in a forest"}) + "\n" for i in range(4)),
+        encoding="utf-8",
+    )
+    outputs = []
+    for run in ("cold", "warm"):
+        output = tmp_path / f"{run}.jsonl"
+        subprocess.run(
+            [
+                sys.executable, str(REPO / "training" / "baseline_generation.py"),
+                "--model", str(tiny_model), "--input", str(prompts), "--output", str(output),
+                "--max_new_tokens", "12", "--stop_strings", "e", "a",
+                "--cache_dir", str(tmp_path / "cache"),
+            ],
+            cwd=tmp_path, check=True, capture_output=True, text=True,
+        )
+        outputs.append(output.read_text(encoding="utf-8"))
+    assert outputs[0] == outputs[1]
+    assert "cached" not in outputs[1]
+
+
+def test_dead_worker_raises_instead_of_hanging():
+    generations = ShardedGeneration(_killed_loader, "unused", ["a", "b", "c", "d"], workers=2)
+    with pytest.raises(RuntimeError, match="exited with code 137"):
+        list(generations)
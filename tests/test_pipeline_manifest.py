@@ -0,0 +1,21 @@
+import argparse
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / "scripts"))
+from instrumentation import add_profile_args  # noqa: E402
+from pipeline_manifest import add_manifest_args, stage_args  # noqa: E402
+
+
+def test_stage_args_ignore_profiling_flags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max_rows", type=int, default=10)
+    add_profile_args(parser)
+    add_manifest_args(parser)
+    flags = [action.option_strings[0] for action in parser._actions if action.dest != "help"]
+    plain = stage_args(parser.parse_args([]))
+    assert plain == {"max_rows": 10}
+    for flag in flags:
+        if flag != "--max_rows":
+            assert stage_args(parser.parse_args([flag])) == plain, flag
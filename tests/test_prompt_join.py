@@ -0,0 +1,62 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / "scripts"))
+from prompt_join import join_by_prompt  # noqa: E402
+
+
+def write_jsonl(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows), encoding="utf-8")
+    return path
+
+
+def naive_join(left_rows, right_rows):
+    """Nested-loop left outer join on prompt: the reference the index must match."""
+    pairs = []
+    for left in left_rows:
+        matches = [right for right in right_rows if right["prompt"] == left["prompt"]]
+        pairs.extend((left, right) for right in matches or [None])
+    return pairs
+
+
+LEFT = [
+    {"prompt": "Create a quest in a forest", "response": "base 1"},
+    {"prompt": "Créer une quête ✨", "response": "base 2"},
+    {"prompt": "No tuned output", "response": "base 3"},
+    {"prompt": "Create a quest in a forest", "response": "base 4"},
+]
+RIGHT = [
+    {"prompt": "Créer une quête ✨", "response": "tuned a"},
+    {"prompt": "Create a quest in a forest", "response": "tuned b"},
+    {"prompt": "Unmatched tuned", "response": "tuned c"},
+    {"prompt": "Create a quest in a forest", "response": "tuned d"},
+]
+
+
+def test_join_matches_nested_loop(tmp_path):
+    left = write_jsonl(tmp_path / "baseline.jsonl", LEFT)
+    right = write_jsonl(tmp_path / "tuned.jsonl", RIGHT)
+    assert list(join_by_prompt(left, right)) == naive_join(LEFT, RIGHT)
+
+
+def test_join_reads_columnar_right_side(tmp_path):
+    pytest.importorskip("pyarrow")
+    from jsonl_utils import convert_split
+
+    left = write_jsonl(tmp_path / "baseline.jsonl", LEFT)
+    right = tmp_path / "tuned.parquet"
+    convert_split(write_jsonl(tmp_path / "tuned.jsonl", RIGHT), right)
+    assert list(join_by_prompt(left, right)) == naive_join(LEFT, RIGHT)
+
+
+def test_digest_collisions_do_not_mismatch_rows(tmp_path, monkeypatch):
+    import prompt_join
+
+    monkeypatch.setattr(prompt_join, "prompt_digest", lambda prompt: b"same")
+    left = write_jsonl(tmp_path / "baseline.jsonl", LEFT)
+    right = write_jsonl(tmp_path / "tuned.jsonl", RIGHT)
+    assert list(join_by_prompt(left, right)) == naive_join(LEFT, RIGHT)
@@ -0,0 +1,37 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / "scripts"))
+from text_metrics import distinct_ns  # noqa: E402
+
+
+def reference_distinct_n(token_lists, n, across_documents):
+    """The pure-Python distinct-n that text_metrics replaced."""
+    streams = [[t for tokens in token_lists for t in tokens]] if across_documents else token_lists
+    grams = [tuple(tokens[i : i + n]) for tokens in streams for i in range(len(tokens) - n + 1)]
+    return len(set(grams)) / len(grams) if grams and n > 0 else 0.0
+
+
+def corpus(vocab_size, seed=0):
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocab_size)]
+    return [[rng.choice(words) for _ in range(rng.randrange(0, 12))] for _ in range(60)]
+
+
+@pytest.mark.parametrize("across_documents", [True, False])
+@pytest.mark.parametrize("vocab_size", [5, 20000])
+def test_distinct_ns_matches_reference(vocab_size, across_documents):
+    token_lists = corpus(vocab_size)
+    # Order 8 over the larger vocabulary overflows int64 codes and takes the fallback path.
+    orders = (1, 2, 3, 8)
+    result = distinct_ns(token_lists, orders=orders, across_documents=across_documents)
+    for n in orders:
+        assert result[n] == reference_distinct_n(token_lists, n, across_documents)
+
+
+def test_distinct_ns_empty_input():
+    assert distinct_ns([[], []], orders=(1, 2)) == {1: 0.0, 2: 0.0}
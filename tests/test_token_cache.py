@@ -0,0 +1,97 @@
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO / "training"))
+pytest.importorskip("torch")
+token_cache = pytest.importorskip("token_cache")
+
+
+def text_fn(record):
+    return f"{record['prompt']} {record['response']}"
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+    words = "<unk> <eos> a the quest hero forest dragon finds slays gold row".split()
+    model = tokenizers.models.WordLevel({word: i for i, word in enumerate(words)}, unk_token="<unk>")
+    backend = tokenizers.Tokenizer(model)
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    return transformers.PreTrainedTokenizerFast(
+        tokenizer_object=backend, unk_token="<unk>", eos_token="<eos>"
+    )
+
+
+def write_split(path, rows):
+    with path.open("a", encoding="utf-8") as handle:
+        for index in range(*rows):
+            # Row lengths vary (including rows that tokenize to nothing but the prompt).
+            response = " ".join(["the dragon finds gold"] * (index % 4))
+            handle.write(json.dumps({"prompt": f"a hero row {index}", "response": response}) + "\n")
+
+
+def expected_ids(path, tokenizer):
+    texts = [text_fn(json.loads(line)) for line in path.read_text(encoding="utf-8").splitlines()]
+    return tokenizer(texts)["input_ids"]
+
+
+def rows_of(tokens, offsets):
+    return [tokens[offsets[i] : offsets[i + 1]].tolist() for i in range(len(offsets) - 1)]
+
+
+def test_cache_round_trips_every_row(tmp_path, tokenizer, monkeypatch):
+    # Small chunks so offsets have to carry across several writes.
+    monkeypatch.setattr(token_cache, "CHUNK_ROWS", 7)
+    source = tmp_path / "train.jsonl"
+    write_split(source, (0, 30))
+
+    tokens, offsets = token_cache.load_token_cache(source, tokenizer, text_fn)
+    assert offsets[0] == 0 and len(offsets) == 31
+    assert rows_of(tokens, offsets) == expected_ids(source, tokenizer)
+
+    cached = token_cache.load_token_cache(source, tokenizer, text_fn)
+    assert np.array_equal(cached[0], tokens) and np.array_equal(cached[1], offsets)
+
+
+def test_max_rows_matches_prefix_of_full_cache(tmp_path, tokenizer):
+    source = tmp_path / "train.jsonl"
+    write_split(source, (0, 30))
+
+    tokens, offsets = token_cache.load_token_cache(source, tokenizer, text_fn, max_rows=12)
+    assert not token_cache.cache_paths(source)["tokens"].exists()
+    full_tokens, full_offsets = token_cache.load_token_cache(source, tokenizer, text_fn)
+    assert np.array_equal(offsets, full_offsets[:13])
+    assert np.array_equal(tokens, full_tokens[: full_offsets[12]])
+
+
+def test_changed_source_rebuilds_cache(tmp_path, tokenizer):
+    source = tmp_path / "train.jsonl"
+    write_split(source, (0, 10))
+    token_cache.load_token_cache(source, tokenizer, text_fn)
+    write_split(source, (10, 15))
+
+    tokens, offsets = token_cache.load_token_cache(source, tokenizer, text_fn)
+    assert rows_of(tokens, offsets) == expected_ids(source, tokenizer)
+
+
+def test_datasets_index_rows_by_offsets():
+    ids = [[2, 3, 4], [5], [6, 7, 8, 9, 10]]
+    offsets = np.cumsum([0] + [len(row) for row in ids])
+    tokens = np.asarray([t for row in ids for t in row], dtype=np.uint16)
+
+    padded = token_cache.MmapTokenDataset(tokens, offsets, block_size=4, pad_token_id=0)
+    assert [padded[i]["input_ids"] for i in range(3)] == [[2, 3, 4, 0], [5, 0, 0, 0], [6, 7, 8, 9]]
+    with pytest.raises(IndexError):
+        padded[3]
+
+    packed = token_cache.PackedTokenDataset(tokens, offsets, block_size=4, eos_token_id=1)
+    stream = [2, 3, 4, 1, 5, 1, 6, 7, 8, 9, 10, 1]
+    assert [packed[i]["input_ids"] for i in range(len(packed))] == [
+        stream[0:4], stream[4:8], stream[8:12]
+    ]
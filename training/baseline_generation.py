@@ -1,30 +1,29 @@
-import json
+import sys
 import argparse
+from functools import partial
 from pathlib import Path
-from tqdm import tqdm
-import torch
-from transformers import GPT2LMHeadModel, GPT2Tokenizer
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+from cpu_inference import add_inference_args, load_for_inference
+from generation_cache import add_cache_args, open_cache
+from generation_engine import GenerationStats, PrefixKVCache, iter_generate
+from generation_workers import ShardedGeneration
+from instrumentation import RunProfile, add_profile_args
+from jsonl_utils import JsonlAppendWriter, load_jsonl_parallel, load_prompt_keys, skip_completed
+from model_loading import import_model_stack, load_tokenizer, load_weights, report_startup
+from stopping import StopConfig, add_stopping_args
 
 def load_test_data(input_path):
-    data = []
-    with open(input_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            data.append(json.loads(line.strip()))
-    return data
-
-def generate_text(model, tokenizer, prompt, max_new_tokens=100, temperature=0.7, top_p=0.9, device='cpu'):
-    input_ids = tokenizer.encode(prompt, return_tensors='pt').to(device)
-    with torch.no_grad():
-        output = model.generate(
-            input_ids,
-            max_new_tokens=max_new_tokens,
-            temperature=temperature,
-            top_p=top_p,
-            do_sample=True,
-            pad_token_id=tokenizer.eos_token_id
-        )
-    generated_text = tokenizer.decode(output[0], skip_special_tokens=True)
-    return generated_text[len(prompt):].strip()
+    return list(load_jsonl_parallel(Path(input_path), fields=('prompt', 'response')))
+
+def load_model(model_name, device):
+    from transformers import GPT2LMHeadModel
+
+    tokenizer = load_tokenizer(model_name)
+    model = load_weights(GPT2LMHeadModel, model_name)
+    model.to(device)
+    model.eval()
+    return tokenizer, model
 
 def main():
     parser = argparse.ArgumentParser()
@@ -33,19 +32,46 @@ def main():
     parser.add_argument('--model', type=str, default='distilgpt2')
     parser.add_argument('--max_samples', type=int, default=None)
     parser.add_argument('--max_new_tokens', type=int, default=100)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--resume', action='store_true',
+                        help='Append to an existing output and skip prompts already generated')
+    parser.add_argument('--fsync_every', type=int, default=50)
+    parser.add_argument('--prefix_cache', action='store_true',
+                        help='Prefill the prompt prefix shared by each batch once and reuse its KV cache')
+    parser.add_argument('--min_prefix_tokens', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Shard prompts across N processes, each with its own model copy')
+    parser.add_argument('--threads_per_worker', type=int, default=None,
+                        help='torch intra-op threads per worker (default: CPU cores / workers)')
+    add_cache_args(parser)
+    add_inference_args(parser)
+    add_stopping_args(parser)
+    add_profile_args(parser)
     args = parser.parse_args()
+    run = RunProfile('baseline_generation', args.output, args.profile, args.profile_json)
+    stopping = StopConfig.from_args(args)
+
+    with run.stage('import'):
+        torch, _ = import_model_stack()
+        from tqdm import tqdm
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"🖥️  Using device: {device}")
 
-    print(f"🤖 Loading model: {args.model}")
-    tokenizer = GPT2Tokenizer.from_pretrained(args.model)
-    model = GPT2LMHeadModel.from_pretrained(args.model)
-    model.to(device)
-    model.eval()
+    cache = prefix_cache = None
+    if args.workers > 1:
+        print(f"🤖 Each of {args.workers} workers loads: {args.model}")
+    else:
+        print(f"🤖 Loading model: {args.model}")
+        with run.stage('load_model'):
+            tokenizer, model = load_for_inference(load_model, args.model, device, args)
+        cache = open_cache(args, args.model, model, seed=None)
+        prefix_cache = PrefixKVCache(model, device, args.min_prefix_tokens) if args.prefix_cache else None
 
     print(f"📖 Loading test data from: {args.input}")
-    test_data = load_test_data(args.input)
+    with run.stage('load_input') as stage:
+        test_data = load_test_data(args.input)
+        stage['rows'] = len(test_data)
 
     if args.max_samples:
         test_data = test_data[:args.max_samples]
@@ -54,34 +80,78 @@ def main():
     print(f"📝 Generating outputs for {len(test_data)} samples...")
 
     output_path = Path(args.output)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    results = []
-    for item in tqdm(test_data, desc="Generating"):
+    prompts = []
+    for item in test_data:
         prompt = item.get('prompt', '')
         if not prompt:
             prompt = item.get('response', '')[:50]
+        prompts.append(prompt)
 
-        generation = generate_text(
-            model, tokenizer, prompt,
+    if args.resume:
+        pending = skip_completed(prompts, load_prompt_keys(output_path))
+        print(f"⏩ Resuming: {len(prompts) - len(pending)} samples already in {args.output}")
+        prompts = [prompts[i] for i in pending]
+
+    first = None
+    if args.workers > 1:
+        generations = ShardedGeneration(
+            partial(load_for_inference, load_model, args=args), args.model, prompts, args.workers,
+            threads=args.threads_per_worker,
+            device=device,
+            cache_args=None if args.no_cache else args,
+            prefix_options={'min_tokens': args.min_prefix_tokens} if args.prefix_cache else None,
+            batch_size=args.batch_size,
             max_new_tokens=args.max_new_tokens,
-            device=device
+            window=args.batch_size * 16,
+            stopping=stopping
         )
+        stats = generations.stats
+    else:
+        stats = GenerationStats()
+        generations = iter_generate(
+            model, tokenizer, prompts,
+            batch_size=args.batch_size,
+            max_new_tokens=args.max_new_tokens,
+            device=device,
+            stats=stats,
+            window=args.batch_size * 16,
+            cache=cache,
+            prefix_cache=prefix_cache,
+            stopping=stopping
+        )
+    print(f"💾 Streaming results to: {args.output}")
+    with run.stage('generate', rows=len(prompts)), \
+            JsonlAppendWriter(output_path, append=args.resume, fsync_every=args.fsync_every) as writer:
+        for index, continuation in tqdm(generations, total=len(prompts), desc="Generating"):
+            result = {
+                'prompt': prompts[index],
+                'generation': continuation.strip()
+            }
+            if stopping:
+                result['stop_reason'] = stats.row_stop_reasons.pop(index)
+            writer.write(result)
+            first = first or result
 
-        results.append({
-            'prompt': prompt,
-            'generation': generation
-        })
-
-    print(f"💾 Saving results to: {args.output}")
-    with open(args.output, 'w', encoding='utf-8') as f:
-        for result in results:
-            f.write(json.dumps(result, ensure_ascii=False) + '\n')
-
-    print(f"✅ Done! Generated {len(results)} outputs")
-    print(f"📊 Sample:")
-    print(f"   Prompt: {results[0]['prompt'][:80]}")
-    print(f"   Generation: {results[0]['generation'][:80]}")
+    print(f"✅ Done! Generated {writer.count} outputs")
+    if args.workers > 1:
+        generations.report()
+        run.set(workers=generations.summary())
+    stats.report()
+    if args.workers > 1:
+        # Workers load in parallel; the slowest one gates the run.
+        report_startup(run, load_seconds=max(w['load_seconds'] for w in generations.workers_summary))
+    else:
+        report_startup(run, stats.first_token_at)
+    if cache is not None:
+        cache.report()
+        cache.close()
+    if first:
+        print(f"📊 Sample:")
+        print(f"   Prompt: {first['prompt'][:80]}")
+        print(f"   Generation: {first['generation'][:80]}")
+    run.set(generation=stats.summary())
+    run.finish()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,158 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+from jsonl_utils import load_jsonl
+from instrumentation import RunProfile, add_profile_args
+from generation_server import percentile
+
+
+async def http_request(host, port, method, path, payload=None, on_line=None):
+    """Minimal HTTP/1.1 client; returns (status, body) and feeds NDJSON lines to on_line."""
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    writer.write(
+        f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        data = b''
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            if size == 0:
+                break
+            chunk = await reader.readexactly(size + 2)
+            data = chunk[:-2]
+            if on_line:
+                on_line(json.loads(data))
+    else:
+        data = await reader.readexactly(int(headers.get('content-length', 0)))
+    writer.close()
+    return status, json.loads(data) if data else {}
+
+
+async def one_request(args, prompt, results):
+    start = time.perf_counter()
+    first = []
+
+    def on_line(line):
+        if 'token' in line and not first:
+            first.append(time.perf_counter() - start)
+
+    payload = {'prompt': prompt, 'max_new_tokens': args.max_new_tokens, 'stream': args.stream}
+    status, body = await http_request(args.host, args.port, 'POST', '/generate', payload, on_line)
+    results.append({
+        'status': status,
+        'latency': time.perf_counter() - start,
+        'ttft': first[0] if first else None,
+        'new_tokens': body.get('new_tokens', 0),
+    })
+
+
+async def run_level(args, prompts, concurrency):
+    """Keep `concurrency` requests in flight until args.requests have completed."""
+    queue = asyncio.Queue()
+    for index in range(args.requests):
+        queue.put_nowait(prompts[index % len(prompts)])
+    results = []
+
+    async def client():
+        while not queue.empty():
+            await one_request(args, queue.get_nowait(), results)
+
+    _, before = await http_request(args.host, args.port, 'GET', '/metrics')
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    _, after = await http_request(args.host, args.port, 'GET', '/metrics')
+
+    ok = [result for result in results if result['status'] == 200]
+    latencies = [result['latency'] for result in ok]
+    ttfts = [result['ttft'] for result in ok if result['ttft'] is not None]
+    batches = after['batches'] - before['batches']
+    rows = after['batched_requests'] - before['batched_requests']
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(ok) / elapsed, 2),
+        'tokens_per_sec': round(sum(result['new_tokens'] for result in ok) / elapsed, 2),
+        'latency_ms': {'p50': round(percentile(latencies, 0.5) * 1000, 1),
+                       'p99': round(percentile(latencies, 0.99) * 1000, 1)},
+        'ttft_ms': {'p50': round(percentile(ttfts, 0.5) * 1000, 1),
+                    'p99': round(percentile(ttfts, 0.99) * 1000, 1)} if ttfts else None,
+        'mean_batch_size': round(rows / batches, 2) if batches else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for generation_server.py.')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--input', type=str, default='evaluation/test_prompts.jsonl')
+    parser.add_argument('--requests', type=int, default=64, help='Requests per concurrency level')
+    parser.add_argument('--concurrency', type=str, default='1,4,16',
+                        help='Comma-separated numbers of concurrent clients')
+    parser.add_argument('--max_new_tokens', type=int, default=40)
+    parser.add_argument('--stream', action='store_true', help='Stream tokens and measure time to first token')
+    parser.add_argument('--output', type=str, default=None, help='Optional JSON report path')
+    add_profile_args(parser)
+    args = parser.parse_args()
+    run = RunProfile('generation_load_test', args.output, args.profile, args.profile_json)
+
+    with run.stage('load_input') as stage:
+        records = list(load_jsonl(Path(args.input)))
+        stage['rows'] = len(records)
+    prompts = [record.get('prompt') or record.get('response') for record in records]
+    prompts = [prompt for prompt in prompts if prompt]
+    if not prompts:
+        raise SystemExit(f"No prompts found in: {args.input}")
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+
+    print(f"📡 Load testing http://{args.host}:{args.port} with {len(prompts)} prompts")
+    report = []
+    for concurrency in levels:
+        try:
+            with run.stage(f'concurrency_{concurrency}', rows=args.requests):
+                result = asyncio.run(run_level(args, prompts, concurrency))
+        except ConnectionError as exc:
+            raise SystemExit(f"Cannot reach the server at {args.host}:{args.port}: {exc}")
+        report.append(result)
+        line = (f"  concurrency {concurrency:>3}: {result['requests_per_sec']} req/s, "
+                f"{result['tokens_per_sec']} tokens/s, latency p50 {result['latency_ms']['p50']}ms "
+                f"p99 {result['latency_ms']['p99']}ms, mean batch {result['mean_batch_size']}")
+        if result['ttft_ms']:
+            line += f", TTFT p50 {result['ttft_ms']['p50']}ms"
+        if result['errors']:
+            line += f", {result['errors']} errors"
+        print(line)
+
+    if report and report[0]['requests_per_sec']:
+        best = max(report, key=lambda result: result['requests_per_sec'])
+        print(f"📈 Best throughput at concurrency {best['concurrency']}: "
+              f"x{best['requests_per_sec'] / report[0]['requests_per_sec']:.2f} "
+              f"vs concurrency {report[0]['concurrency']}")
+    if args.output:
+        output_path = Path(args.output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f"💾 Report saved to {output_path}")
+    run.finish()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+from cpu_inference import add_inference_args, load_for_inference
+from generation_engine import build_batch, prepare_tokenizer
+from instrumentation import RunProfile, add_profile_args
+from model_loading import import_model_stack, report_startup
+
+MAX_BODY_BYTES = 1024 * 1024
+LATENCY_WINDOW = 10_000
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (0 when there are no samples)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class GenerationRequest:
+    """One queued prompt; text pieces are pushed from the model thread via the event loop."""
+
+    def __init__(self, prompt, max_new_tokens):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.arrived = time.perf_counter()
+        self.first_token = None
+        self.finished = None
+        self.text = ''
+        self.new_tokens = 0
+        self.error = None
+        self.pieces = asyncio.Queue()
+
+    def push(self, piece):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.text += piece
+        self.pieces.put_nowait(piece)
+
+    def finish(self, new_tokens, error=None):
+        self.finished = time.perf_counter()
+        self.new_tokens = new_tokens
+        self.error = error
+        self.pieces.put_nowait(None)
+
+    async def stream(self):
+        while True:
+            piece = await self.pieces.get()
+            if piece is None:
+                return
+            yield piece
+
+
+class BatchStreamer:
+    """Streamer for model.generate that fans a batch out to its requests.
+
+    generate() calls put() once with the prompt ids, then once per decode step
+    with one token per row. Each row is decoded incrementally and stops at EOS or
+    at its own max_new_tokens; text is handed to the event loop thread-safely.
+    """
+
+    def __init__(self, tokenizer, requests, loop):
+        self.tokenizer = tokenizer
+        self.requests = requests
+        self.loop = loop
+        self.ids = [[] for _ in requests]
+        self.sent = [''] * len(requests)
+        self.done = [False] * len(requests)
+        self.prompt_seen = False
+
+    @property
+    def all_done(self):
+        return all(self.done)
+
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        for row, token_id in enumerate(value.reshape(-1).tolist()):
+            if self.done[row]:
+                continue
+            if token_id == self.tokenizer.eos_token_id:
+                self._close(row)
+                continue
+            self.ids[row].append(token_id)
+            text = self.tokenizer.decode(self.ids[row], skip_special_tokens=True)
+            # Hold back pieces that end inside a multi-byte character.
+            if not text.endswith('�') and len(text) > len(self.sent[row]):
+                self.loop.call_soon_threadsafe(
+                    self.requests[row].push, text[len(self.sent[row]):]
+                )
+                self.sent[row] = text
+            if len(self.ids[row]) >= self.requests[row].max_new_tokens:
+                self._close(row)
+
+    def _close(self, row, error=None):
+        self.done[row] = True
+        self.loop.call_soon_threadsafe(self.requests[row].finish, len(self.ids[row]), error)
+
+    def end(self, error=None):
+        for row in range(len(self.requests)):
+            if not self.done[row]:
+                self._close(row, error)
+
+
+class AllRowsDone:
+    """Stopping criterion: end the batch once every row hit EOS or its own token limit."""
+
+    def __init__(self, streamer):
+        self.streamer = streamer
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        return torch.full((input_ids.shape[0],), self.streamer.all_done, dtype=torch.bool,
+                          device=input_ids.device)
+
+
+class GenerationServer:
+    """Queue requests, group them into micro-batches and run batched generation.
+
+    The batcher waits for a first request, then keeps collecting for up to
+    `batch_window` seconds or `max_batch_size` requests. Generation runs on one
+    model thread, so requests arriving meanwhile form the next, larger batch.
+    """
+
+    def __init__(self, tokenizer, model, device, args):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device
+        self.args = args
+        self.batch_window = args.batch_window_ms / 1000
+        self.queue = asyncio.Queue(maxsize=args.max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.ttfts = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.perf_counter()
+        self.in_flight = 0
+        self.requests = 0
+        self.completed = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batched_rows = 0
+        self.new_tokens = 0
+        self.busy_seconds = 0.0
+
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.args.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and self.queue.empty():
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), max(timeout, 0)))
+                except asyncio.TimeoutError:
+                    break
+            self.in_flight = len(batch)
+            await loop.run_in_executor(self.executor, self.generate_batch, batch, loop)
+            self.in_flight = 0
+
+    def generate_batch(self, batch, loop):
+        import torch
+        from transformers import StoppingCriteriaList
+
+        start = time.perf_counter()
+        streamer = BatchStreamer(self.tokenizer, batch, loop)
+        try:
+            eos = self.tokenizer.eos_token_id
+            rows = [self.tokenizer.encode(request.prompt) or [eos] for request in batch]
+            input_ids, attention_mask = build_batch(rows, 0, self.tokenizer.pad_token_id)
+            sampling = {'do_sample': False}
+            if self.args.temperature > 0:
+                sampling = {'do_sample': True, 'temperature': self.args.temperature,
+                            'top_p': self.args.top_p}
+            with torch.no_grad():
+                self.model.generate(
+                    input_ids.to(self.device),
+                    attention_mask=attention_mask.to(self.device),
+                    max_new_tokens=max(request.max_new_tokens for request in batch),
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([AllRowsDone(streamer)]),
+                    **sampling
+                )
+            streamer.end()
+        except Exception as exc:
+            streamer.end(error=f'{type(exc).__name__}: {exc}')
+        self.batches += 1
+        self.batched_rows += len(batch)
+        self.new_tokens += sum(len(ids) for ids in streamer.ids)
+        self.busy_seconds += time.perf_counter() - start
+
+    def metrics(self):
+        uptime = time.perf_counter() - self.started
+        return {
+            'queue_depth': self.queue.qsize(),
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'batched_requests': self.batched_rows,
+            'mean_batch_size': round(self.batched_rows / self.batches, 2) if self.batches else 0.0,
+            'new_tokens': self.new_tokens,
+            'tokens_per_sec': round(self.new_tokens / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+            'utilization': round(self.busy_seconds / uptime, 4) if uptime else 0.0,
+            'latency_ms': {'p50': round(percentile(self.latencies, 0.5) * 1000, 1),
+                           'p99': round(percentile(self.latencies, 0.99) * 1000, 1)},
+            'ttft_ms': {'p50': round(percentile(self.ttfts, 0.5) * 1000, 1),
+                        'p99': round(percentile(self.ttfts, 0.99) * 1000, 1)},
+            'uptime_seconds': round(uptime, 1),
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, body = await read_request(reader)
+            if method == 'GET' and path == '/metrics':
+                await send_json(writer, 200, self.metrics())
+            elif method == 'GET' and path == '/health':
+                await send_json(writer, 200, {'status': 'ok'})
+            elif method == 'POST' and path == '/generate':
+                await self.generate(writer, json.loads(body or b'{}'))
+            else:
+                await send_json(writer, 404, {'error': f'No route for {method} {path}'})
+        except (ValueError, asyncio.IncompleteReadError) as exc:
+            await send_json(writer, 400, {'error': str(exc)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def generate(self, writer, payload):
+        if not isinstance(payload, dict):
+            raise ValueError('Request body must be a JSON object')
+        prompt = payload.get('prompt')
+        if not isinstance(prompt, str) or not prompt:
+            raise ValueError("'prompt' must be a non-empty string")
+        try:
+            limit = int(payload.get('max_new_tokens') or self.args.max_new_tokens)
+        except (TypeError, ValueError):
+            raise ValueError("'max_new_tokens' must be an integer")
+        request = GenerationRequest(prompt, max(1, min(limit, self.args.max_new_tokens)))
+        try:
+            self.queue.put_nowait(request)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            await send_json(writer, 503, {'error': 'queue full', 'queue_depth': self.queue.qsize()})
+            return
+        self.requests += 1
+
+        if payload.get('stream'):
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                         b'Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+            async for piece in request.stream():
+                await write_chunk(writer, {'token': piece})
+            await write_chunk(writer, self.result(request))
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        else:
+            async for _ in request.stream():
+                pass
+            await send_json(writer, 500 if request.error else 200, self.result(request))
+
+    def result(self, request):
+        latency = request.finished - request.arrived
+        self.completed += 1
+        self.latencies.append(latency)
+        if request.first_token is not None:
+            self.ttfts.append(request.first_token - request.arrived)
+        result = {'done': True, 'generation': request.text.strip(), 'new_tokens': request.new_tokens,
+                  'latency_ms': round(latency * 1000, 1)}
+        if request.error:
+            result['error'] = request.error
+        return result
+
+
+async def read_request(reader):
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    if not request_line:
+        raise ValueError('Empty request')
+    method, target, _ = request_line.split(' ', 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError('Request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target.split('?', 1)[0], body
+
+
+async def send_json(writer, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    writer.write(
+        f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "Error")}\r\n'
+        f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+        f'Connection: close\r\n\r\n'.encode('latin-1') + body
+    )
+    await writer.drain()
+
+
+async def write_chunk(writer, payload):
+    data = (json.dumps(payload, ensure_ascii=False) + '\n').encode('utf-8')
+    writer.write(f'{len(data):x}\r\n'.encode('latin-1') + data + b'\r\n')
+    await writer.drain()
+
+
+async def serve(server, host, port):
+    batcher = asyncio.create_task(server.batcher())
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"🚀 Serving on http://{host}:{port} (POST /generate, GET /metrics)")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        batcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local micro-batching generation server.')
+    parser.add_argument('--model', type=str, default='distilgpt2')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max_batch_size', type=int, default=8)
+    parser.add_argument('--batch_window_ms', type=float, default=10.0,
+                        help='How long the first request of a batch waits for company')
+    parser.add_argument('--max_new_tokens', type=int, default=100,
+                        help='Default and upper bound for per-request max_new_tokens')
+    parser.add_argument('--temperature', type=float, default=0.7, help='0 for greedy decoding')
+    parser.add_argument('--top_p', type=float, default=0.9)
+    parser.add_argument('--max_queue', type=int, default=256,
+                        help='Requests beyond this queue depth get HTTP 503')
+    add_inference_args(parser)
+    add_profile_args(parser)
+    args = parser.parse_args()
+    run = RunProfile('generation_server', profile=args.profile, profile_json=args.profile_json)
+
+    with run.stage('import'):
+        torch, _ = import_model_stack()
+        from baseline_generation import load_model
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"🖥️  Using device: {device}")
+    print(f"🤖 Loading model: {args.model}")
+    with run.stage('load_model'):
+        tokenizer, model = load_for_inference(load_model, args.model, device, args)
+    prepare_tokenizer(tokenizer)
+    report_startup(run)
+
+    async def run_server():
+        server = GenerationServer(tokenizer, model, device, args)
+        try:
+            await serve(server, args.host, args.port)
+        finally:
+            metrics = server.metrics()
+            run.set(metrics=metrics)
+            print(f"📊 Final metrics: {json.dumps(metrics)}")
+
+    try:
+        with run.stage('serve'):
+            asyncio.run(run_server())
+    except KeyboardInterrupt:
+        print("👋 Server stopped")
+    finally:
+        run.finish()
+
+if __name__ == '__main__':
+    main()
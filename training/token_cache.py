@@ -0,0 +1,201 @@
+import hashlib
+import json
+from itertools import islice
+from pathlib import Path
+
+import sys
+
+import numpy as np
+from torch.utils.data import Dataset
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+from jsonl_utils import load_jsonl
+from pipeline_manifest import file_digest
+
+CACHE_VERSION = 2
+CHUNK_ROWS = 1000
+
+
+def tokenizer_fingerprint(tokenizer):
+    payload = json.dumps({
+        'class': type(tokenizer).__name__,
+        'vocab': sorted(tokenizer.get_vocab().items()),
+        'special': tokenizer.special_tokens_map,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cache_paths(source_path):
+    source_path = Path(source_path)
+    prefix = source_path.parent / source_path.stem
+    return {
+        'tokens': Path(f"{prefix}.tokens.npy"),
+        'offsets': Path(f"{prefix}.offsets.npy"),
+        'meta': Path(f"{prefix}.tokens.json"),
+    }
+
+
+def read_texts(source_path, text_fn):
+    for record in load_jsonl(Path(source_path), fields=('prompt', 'response')):
+        yield text_fn(record)
+
+
+def build_token_cache(source_path, tokenizer, text_fn, meta):
+    """Tokenize a JSONL split once into a flat token array plus an offsets index."""
+    paths = cache_paths(source_path)
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    raw_path = Path(f"{paths['tokens']}.tmp")
+
+    offsets = [0]
+    chunk = []
+    with open(raw_path, 'wb') as raw:
+        for text in read_texts(source_path, text_fn):
+            chunk.append(text)
+            if len(chunk) >= CHUNK_ROWS:
+                offsets = _write_chunk(raw, tokenizer, chunk, dtype, offsets)
+                chunk = []
+        if chunk:
+            offsets = _write_chunk(raw, tokenizer, chunk, dtype, offsets)
+
+    total = offsets[-1]
+    tokens = np.lib.format.open_memmap(paths['tokens'], mode='w+', dtype=dtype, shape=(total,))
+    if total:
+        tokens[:] = np.memmap(raw_path, dtype=dtype, mode='r', shape=(total,))
+    tokens.flush()
+    del tokens
+    raw_path.unlink()
+
+    np.save(paths['offsets'], np.asarray(offsets, dtype=np.int64))
+    paths['meta'].write_text(json.dumps(meta, indent=2), encoding='utf-8')
+
+
+def _write_chunk(raw, tokenizer, texts, dtype, offsets):
+    for ids in tokenizer(texts)['input_ids']:
+        np.asarray(ids, dtype=dtype).tofile(raw)
+        offsets.append(offsets[-1] + len(ids))
+    return offsets
+
+
+def tokenize_rows(source_path, tokenizer, text_fn, max_rows):
+    """In-memory (tokens, offsets) for the first max_rows rows, without touching the cache."""
+    texts = list(islice(read_texts(source_path, text_fn), max_rows))
+    ids = tokenizer(texts)['input_ids'] if texts else []
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in ids], out=offsets[1:])
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    tokens = np.fromiter((t for row in ids for t in row), dtype=dtype, count=int(offsets[-1]))
+    return tokens, offsets
+
+
+def load_token_cache(source_path, tokenizer, text_fn, max_rows=None):
+    """Return memory-mapped (tokens, offsets), rebuilding them if the source or tokenizer changed.
+
+    The source hash is reused while the file's size and mtime are unchanged, so
+    a warm start does not re-read the split. With ``max_rows`` and no valid cache,
+    only those rows are tokenized (in memory) and the full cache is left unbuilt.
+    """
+    paths = cache_paths(source_path)
+    previous = {}
+    if all(p.exists() for p in paths.values()):
+        previous = json.loads(paths['meta'].read_text(encoding='utf-8'))
+    previous_source = previous.get('source') if previous.get('version') == CACHE_VERSION else None
+    meta = {
+        'version': CACHE_VERSION,
+        'source': file_digest(Path(source_path), previous_source),
+        'tokenizer': tokenizer_fingerprint(tokenizer),
+    }
+    fresh = (
+        previous_source is not None
+        and previous_source['sha256'] == meta['source']['sha256']
+        and previous.get('tokenizer') == meta['tokenizer']
+    )
+    if fresh:
+        print(f"⚡ Using token cache for {source_path}")
+        if previous != meta:
+            # Touched but unchanged: record the new mtime so the next start skips hashing.
+            paths['meta'].write_text(json.dumps(meta, indent=2), encoding='utf-8')
+    elif max_rows:
+        print(f"🔧 Tokenizing the first {max_rows} rows of {source_path} (cache left unbuilt)")
+        return tokenize_rows(source_path, tokenizer, text_fn, max_rows)
+    else:
+        print(f"🔧 Building token cache for {source_path}")
+        build_token_cache(source_path, tokenizer, text_fn, meta)
+
+    tokens = np.load(paths['tokens'], mmap_mode='r')
+    offsets = np.load(paths['offsets'], mmap_mode='r')
+    return tokens, offsets
+
+
+class MmapTokenDataset(Dataset):
+    """One example per row, truncated to block_size and optionally padded to it."""
+
+    def __init__(self, tokens, offsets, block_size, pad_token_id, pad=True, max_rows=None):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.block_size = block_size
+        self.pad_token_id = pad_token_id
+        self.pad = pad
+        rows = len(offsets) - 1
+        self.rows = min(rows, max_rows) if max_rows else rows
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.rows:
+            raise IndexError(index)
+        start = int(self.offsets[index])
+        end = min(int(self.offsets[index + 1]), start + self.block_size)
+        ids = self.tokens[start:end].tolist()
+        mask = [1] * len(ids)
+        if self.pad:
+            missing = self.block_size - len(ids)
+            ids = ids + [self.pad_token_id] * missing
+            mask = mask + [0] * missing
+        return {'input_ids': ids, 'attention_mask': mask}
+
+    def real_tokens(self):
+        lengths = np.diff(self.offsets[: self.rows + 1])
+        return int(np.minimum(lengths, self.block_size).sum())
+
+
+class PackedTokenDataset(Dataset):
+    """Fixed-size blocks over the token stream with an EOS after every example."""
+
+    def __init__(self, tokens, offsets, block_size, eos_token_id, max_rows=None):
+        rows = len(offsets) - 1
+        rows = min(rows, max_rows) if max_rows else rows
+        self.tokens = tokens
+        self.offsets = offsets[: rows + 1]
+        # Start of each example in the packed stream (each earlier example adds one EOS).
+        self.packed_starts = np.asarray(self.offsets[:-1], dtype=np.int64) + np.arange(rows)
+        self.packed_length = int(self.offsets[-1]) + rows
+        self.block_size = block_size
+        self.eos_token_id = eos_token_id
+
+    def __len__(self):
+        return self.packed_length // self.block_size
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        position = index * self.block_size
+        end = position + self.block_size
+        row = int(np.searchsorted(self.packed_starts, position, side='right')) - 1
+        ids = []
+        while position < end:
+            row_start = int(self.offsets[row])
+            row_length = int(self.offsets[row + 1]) - row_start
+            inner = position - int(self.packed_starts[row])
+            if inner < row_length:
+                take = min(row_length - inner, end - position)
+                ids.extend(self.tokens[row_start + inner: row_start + inner + take].tolist())
+                position += take
+            else:
+                ids.append(self.eos_token_id)
+                position += 1
+                row += 1
+        return {'input_ids': ids}
+
+    def real_tokens(self):
+        return len(self) * self.block_size
@@ -1,22 +1,67 @@
-import json
+import sys
 import argparse
+import inspect
 from pathlib import Path
-from transformers import (
-    GPT2LMHeadModel,
-    GPT2Tokenizer,
-    Trainer,
-    TrainingArguments,
-    DataCollatorForLanguageModeling
-)
-from datasets import Dataset
-import torch
-
-def load_jsonl(path):
-    data = []
-    with open(path, 'r', encoding='utf-8') as f:
-        for line in f:
-            data.append(json.loads(line.strip()))
-    return data
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+from instrumentation import RunProfile, add_profile_args
+from model_loading import import_model_stack, load_tokenizer, load_weights, report_startup
+
+def training_text(record):
+    return record.get('prompt', '') + ' ' + record.get('response', '')
+
+
+def collate_packed(features):
+    import torch
+
+    input_ids = torch.tensor([f['input_ids'] for f in features], dtype=torch.long)
+    return {
+        'input_ids': input_ids,
+        'attention_mask': torch.ones_like(input_ids),
+        'labels': input_ids.clone(),
+    }
+
+
+class TokenCountingCollator:
+    """Wrap a collator and count real vs padded tokens in every batch it builds."""
+
+    def __init__(self, collator):
+        self.collator = collator
+        self.real_tokens = 0
+        self.total_tokens = 0
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        self.real_tokens += int(batch['attention_mask'].sum())
+        self.total_tokens += batch['attention_mask'].numel()
+        return batch
+
+    @property
+    def pad_fraction(self):
+        if not self.total_tokens:
+            return 0.0
+        return 1 - self.real_tokens / self.total_tokens
+
+
+def length_grouping_kwargs(enabled):
+    from transformers import TrainingArguments
+
+    if not enabled:
+        return {}
+    # transformers 5 replaced group_by_length with train_sampling_strategy.
+    if 'train_sampling_strategy' in inspect.signature(TrainingArguments.__init__).parameters:
+        return {'train_sampling_strategy': 'group_by_length'}
+    return {'group_by_length': True}
+
+
+def build_dataset(tokens, offsets, tokenizer, args, max_rows):
+    from token_cache import MmapTokenDataset, PackedTokenDataset
+
+    if args.packing:
+        return PackedTokenDataset(tokens, offsets, args.block_size, tokenizer.eos_token_id, max_rows)
+    return MmapTokenDataset(tokens, offsets, args.block_size, tokenizer.pad_token_id,
+                            pad=not args.dynamic_padding, max_rows=max_rows)
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -27,40 +72,52 @@ def main():
     parser.add_argument('--epochs',     type=int, default=3)
     parser.add_argument('--batch_size', type=int, default=8)
     parser.add_argument('--max_samples',type=int, default=None)
+    parser.add_argument('--block_size', type=int, default=256)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--packing', action='store_true',
+                      help='Concatenate examples with EOS into full block_size blocks')
+    mode.add_argument('--dynamic_padding', action='store_true',
+                      help='Pad per batch and group batches by length')
+    add_profile_args(parser)
     args = parser.parse_args()
+    run = RunProfile('train_model', args.output_dir, args.profile, args.profile_json)
+
+    with run.stage('import'):
+        torch, _ = import_model_stack()
+        from transformers import (
+            GPT2LMHeadModel,
+            Trainer,
+            TrainingArguments,
+            DataCollatorForLanguageModeling
+        )
+        from token_cache import load_token_cache
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"🖥️  Using device: {device}")
 
     print(f"🤖 Loading model: {args.model}")
-    tokenizer = GPT2Tokenizer.from_pretrained(args.model)
-    tokenizer.pad_token = tokenizer.eos_token
-    model = GPT2LMHeadModel.from_pretrained(args.model)
-
-    print("📖 Loading data...")
-    train_raw = load_jsonl(args.train_data)
-    val_raw   = load_jsonl(args.val_data)
+    with run.stage('load_model'):
+        tokenizer = load_tokenizer(args.model)
+        tokenizer.pad_token = tokenizer.eos_token
+        model = load_weights(GPT2LMHeadModel, args.model)
+    report_startup(run)
 
+    train_rows = val_rows = None
     if args.max_samples:
-        train_raw = train_raw[:args.max_samples]
-        val_raw   = val_raw[:max(1, args.max_samples // 8)]
+        train_rows = args.max_samples
+        val_rows = max(1, args.max_samples // 8)
 
-    print(f"   Train: {len(train_raw)} | Val: {len(val_raw)} samples")
+    print("📖 Loading token caches...")
+    with run.stage('tokenize') as stage:
+        train_tokens, train_offsets = load_token_cache(args.train_data, tokenizer, training_text,
+                                                       max_rows=train_rows)
+        val_tokens, val_offsets = load_token_cache(args.val_data, tokenizer, training_text,
+                                                   max_rows=val_rows)
+        stage['rows'] = len(train_offsets) + len(val_offsets) - 2
 
-    # Build text list
-    train_texts = [d.get('prompt','') + ' ' + d.get('response','') for d in train_raw]
-    val_texts   = [d.get('prompt','') + ' ' + d.get('response','') for d in val_raw]
-
-    print("🔧 Tokenizing...")
-    # Batch tokenize - much faster
-    train_enc = tokenizer(train_texts, truncation=True, max_length=256, padding='max_length')
-    val_enc   = tokenizer(val_texts,   truncation=True, max_length=256, padding='max_length')
-
-    train_enc['labels'] = train_enc['input_ids'].copy()
-    val_enc['labels']   = val_enc['input_ids'].copy()
-
-    train_dataset = Dataset.from_dict(train_enc)
-    val_dataset   = Dataset.from_dict(val_enc)
+    train_dataset = build_dataset(train_tokens, train_offsets, tokenizer, args, train_rows)
+    val_dataset   = build_dataset(val_tokens, val_offsets, tokenizer, args, val_rows)
+    print(f"   Train: {len(train_dataset)} | Val: {len(val_dataset)} samples")
 
     print("✅ Tokenizing done!")
 
@@ -78,24 +135,41 @@ def main():
         warmup_steps=50,
         weight_decay=0.01,
         load_best_model_at_end=True,
-        report_to="none"
+        report_to="none",
+        **length_grouping_kwargs(args.dynamic_padding)
     )
 
+    if args.packing:
+        collator = TokenCountingCollator(collate_packed)
+    else:
+        collator = TokenCountingCollator(DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False))
+
     trainer = Trainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
-        data_collator=DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False),
+        data_collator=collator,
     )
 
     print("🚀 Starting fine-tuning...")
-    trainer.train()
+    with run.stage('train', rows=len(train_dataset) * args.epochs):
+        train_result = trainer.train()
+
+    runtime = train_result.metrics.get('train_runtime', 0.0)
+    train_tokens = train_dataset.real_tokens()
+    if runtime:
+        print(f"⚡ Effective tokens/sec: {train_tokens * args.epochs / runtime:.1f}")
+    print(f"🧮 Pad-token fraction: {collator.pad_fraction:.1%} "
+          f"({collator.real_tokens}/{collator.total_tokens} real tokens collated)")
 
     print(f"💾 Saving model to {args.output_dir}")
-    trainer.save_model(args.output_dir)
-    tokenizer.save_pretrained(args.output_dir)
+    with run.stage('save'):
+        trainer.save_model(args.output_dir)
+        tokenizer.save_pretrained(args.output_dir)
     print("✅ Training complete!")
+    run.set(pad_fraction=round(collator.pad_fraction, 4), real_tokens=train_tokens)
+    run.finish()
 
 if __name__ == '__main__':
     main()